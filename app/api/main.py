@@ -1,18 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import Any, Optional, Dict, List
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
+from typing import Annotated, Any, Optional, Dict, List, Literal
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
 import time
 import logging
+import orjson
 from contextlib import asynccontextmanager
 
 # Import your modules
-from ..graph.pipeline import run_pipeline
+from ..graph.pipeline import run_pipeline, initialize_pipeline, clear_pipeline_cache, warm_schema
+from ..executors.sqlite_exec import run_sql, ping, close_pool
 from ..utils.logger import get_logger
+from ..utils import audit
+try:
+    # Only needed for the LLM probes; the API still serves cached plans without it
+    from ..models.sql_agent import question_to_sql
+except Exception:
+    question_to_sql = None
 
 logger = get_logger("fastapi_main")
 
+# run_pipeline is synchronous (LLM HTTP calls + sqlite), so it runs on a bounded
+# pool instead of the event loop thread.
+PIPELINE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PIPELINE_WORKERS", "8")),
+    thread_name_prefix="pipeline",
+)
+
+@functools.lru_cache(maxsize=1)
+def _ts(sec: int) -> str:
+    """UTC timestamp string, formatted at most once per second."""
+    return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(sec))
+
 # Lifespan management for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -22,7 +46,6 @@ async def lifespan(app: FastAPI):
     # Initialize any required services
     try:
         # Test database connection
-        from ..executors.sqlite_exec import run_sql
         test_result = run_sql("SELECT 1 as test")
         if test_result.get("error"):
             logger.error(f"Database connection failed: {test_result['error']}")
@@ -33,16 +56,24 @@ async def lifespan(app: FastAPI):
     
     # Initialize pipeline and clear cache
     try:
-        from ..graph.pipeline import initialize_pipeline
         initialize_pipeline()
         logger.info("✅ Pipeline initialized with fresh cache")
     except Exception as e:
         logger.warning(f"⚠️ Pipeline initialization issue: {e}")
     
+    # Read the schema once here instead of on the first request; the key as of startup is kept on app.state
+    try:
+        app.state.schema_key = warm_schema()
+        logger.info("✅ Schema cache warmed")
+    except Exception as e:
+        app.state.schema_key = None
+        logger.warning(f"⚠️ Schema warmup failed: {e}")
+    
     # Test LLM connection
     logger.info("🧪 Testing LLM integration...")
     try:
-        from ..models.sql_agent import question_to_sql
+        if question_to_sql is None:
+            raise RuntimeError("sql_agent is not importable")
         logger.info("🔌 Attempting LLM connection...")
         test_sql = question_to_sql("SELECT 1 as test")
         logger.info("✅ LLM integration verified successfully")
@@ -57,6 +88,17 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("🛑 Banking Query API shutting down...")
+    try:
+        if not audit.shutdown(timeout_s=5.0):
+            logger.warning("⚠️ Audit writer still busy after 5.0s; unflushed records are lost")
+        if audit.dropped:
+            logger.warning("⚠️ Audit log dropped %d records (queue full)", audit.dropped)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to flush audit log: {e}")
+    try:
+        close_pool()
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to close database pool: {e}")
 
 # Create FastAPI app with enhanced configuration
 app = FastAPI(
@@ -74,6 +116,7 @@ app = FastAPI(
     """,
     version="2.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc"
 )
@@ -89,11 +132,17 @@ app.add_middleware(
 
 # Request/Response models
 class AskRequest(BaseModel):
-    question: str = Field(..., min_length=3, max_length=500, description="Natural language question about banking data")
-    role: str = Field(default="analyst", description="User role: analyst, viewer, or admin")
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    question: Annotated[str, StringConstraints(min_length=3, max_length=500)] = Field(..., description="Natural language question about banking data")
+    # Literal is checked inside pydantic-core; unknown roles are rejected with a 422
+    role: Literal["analyst", "viewer", "admin"] = Field(default="analyst", description="User role: analyst, viewer, or admin")
     user: str = Field(default="anonymous", description="User identifier for audit logging")
+    columnar: bool = Field(default=False, description="Return results as per-column lists (table.column_data) instead of rows")
 
 class AskResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     explanation: str = Field(description="Generated SQL query")
     guard_reason: str = Field(description="Security validation reason")
     table: Dict[str, Any] = Field(description="Query results with columns, rows, and metadata")
@@ -106,20 +155,9 @@ class HealthResponse(BaseModel):
     services: Dict[str, str]
     version: str
 
-# Dependency for request validation
-async def validate_role(request: AskRequest) -> AskRequest:
-    """Validate user role"""
-    valid_roles = ["analyst", "viewer", "admin"]
-    if request.role not in valid_roles:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid role. Must be one of: {', '.join(valid_roles)}"
-        )
-    return request
-
 # Main query endpoint
 @app.post("/ask", response_model=AskResponse, summary="Execute Natural Language Query")
-async def ask_question(request: AskRequest = Depends(validate_role)):
+async def ask_question(request: AskRequest):
     """
     Convert natural language question to SQL and execute against banking database.
     
@@ -137,23 +175,29 @@ async def ask_question(request: AskRequest = Depends(validate_role)):
     start_time = time.time()
     
     try:
-        logger.info(f"🔄 Processing query from {request.user} ({request.role}): {request.question[:80]}...")
-        logger.debug(f"Full question: {request.question}")
+        logger.info("🔄 Processing query from %s (%s): %.80s...", request.user, request.role, request.question)
+        logger.debug("Full question: %s", request.question)
         
         # Execute pipeline
         logger.info("🚀 Executing pipeline...")
-        result = run_pipeline(
-            question=request.question,
-            role=request.role,
-            user=request.user
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            PIPELINE_EXECUTOR,
+            functools.partial(
+                run_pipeline,
+                question=request.question,
+                role=request.role,
+                user=request.user,
+                columnar=request.columnar,
+            ),
         )
         
         execution_time = time.time() - start_time
         
         # Log pipeline results
-        logger.info(f"📊 Pipeline completed - SQL generated: {bool(result.get('sql'))}")
+        logger.info("📊 Pipeline completed - SQL generated: %s", bool(result.get('sql')))
         if result.get('sql'):
-            logger.info(f"🔍 Generated SQL: {result.get('sql', '')[:100]}...")
+            logger.info("🔍 Generated SQL: %.100s...", result.get('sql', ''))
         
         # Determine success
         table_data = result.get("table", {})
@@ -169,11 +213,11 @@ async def ask_question(request: AskRequest = Depends(validate_role)):
         }
         
         if success:
-            row_count = len(table_data.get("rows", []))
-            logger.info(f"✅ Query completed successfully in {execution_time:.3f}s - {row_count} rows returned")
+            row_count = table_data.get("row_count", len(table_data.get("rows", [])))
+            logger.info("✅ Query completed successfully in %.3fs - %d rows returned", execution_time, row_count)
         else:
             error_msg = table_data.get("error", "Unknown error")
-            logger.warning(f"⚠️ Query completed with error in {execution_time:.3f}s: {error_msg}")
+            logger.warning("⚠️ Query completed with error in %.3fs: %s", execution_time, error_msg)
             
         return AskResponse(**response_data)
         
@@ -181,7 +225,7 @@ async def ask_question(request: AskRequest = Depends(validate_role)):
         raise
     except Exception as e:
         execution_time = time.time() - start_time
-        logger.error(f"Query processing failed after {execution_time:.3f}s: {str(e)}")
+        logger.error("Query processing failed after %.3fs: %s", execution_time, e)
         
         raise HTTPException(
             status_code=500,
@@ -192,33 +236,41 @@ async def ask_question(request: AskRequest = Depends(validate_role)):
             }
         )
 
+# Last serialized /health body and when it was built (time.monotonic()).
+# Refreshed at most once per HEALTH_TTL_S; no lock needed since the rebuild
+# never awaits, so it can't interleave on the event loop.
+HEALTH_TTL_S = 1.0
+_health_cache = (float("-inf"), b"")
+
 # Health check endpoint
 @app.get("/health", response_model=HealthResponse, summary="System Health Check")
 async def health_check():
     """Get system health status and service availability"""
-    
+    global _health_cache
+    built_at, body = _health_cache
+    now = time.monotonic()
+    if now - built_at >= HEALTH_TTL_S:
+        body = orjson.dumps(_build_health().model_dump())
+        _health_cache = (now, body)
+    return Response(content=body, media_type="application/json")
+
+def _build_health() -> HealthResponse:
     services = {}
     
     # Check database
     try:
-        from ..executors.sqlite_exec import run_sql
-        result = run_sql("SELECT 1 as health_check")
-        services["database"] = "healthy" if not result.get("error") else "error"
+        services["database"] = "healthy" if ping() else "error"
     except Exception:
         services["database"] = "error"
     
-    # Check LLM service
-    try:
-        from ..models.sql_agent import question_to_sql
-        services["llm"] = "healthy"  # If import succeeds, LLM integration is available
-    except Exception:
-        services["llm"] = "unavailable"
+    # Check LLM service: available if sql_agent imported at startup
+    services["llm"] = "healthy" if question_to_sql is not None else "unavailable"
     
     overall_status = "healthy" if all(s == "healthy" for s in services.values()) else "degraded"
     
     return HealthResponse(
         status=overall_status,
-        timestamp=time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime()),
+        timestamp=_ts(int(time.time())),
         services=services,
         version="2.0.0"
     )
@@ -227,13 +279,12 @@ async def health_check():
 async def clear_cache_endpoint():
     """Clear the pipeline cache manually"""
     try:
-        from ..graph.pipeline import clear_pipeline_cache
         result = clear_pipeline_cache()
         logger.info("🗑️ Cache cleared via API endpoint")
         return {
             "success": True,
             "message": "Cache cleared successfully",
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
+            "timestamp": _ts(int(time.time()))
         }
     except Exception as e:
         logger.error(f"❌ Failed to clear cache: {e}")
@@ -243,7 +294,8 @@ async def clear_cache_endpoint():
 async def test_llm_endpoint():
     """Test LLM integration directly"""
     try:
-        from ..models.sql_agent import question_to_sql
+        if question_to_sql is None:
+            raise RuntimeError("sql_agent is not importable")
         logger.info("🧪 Testing LLM via admin endpoint")
         
         test_question = "SELECT 1 as test"
@@ -259,7 +311,7 @@ async def test_llm_endpoint():
             "question": test_question,
             "generated_sql": result,
             "execution_time": round(execution_time, 3),
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
+            "timestamp": _ts(int(time.time()))
         }
     except Exception as e:
         logger.error(f"❌ LLM test failed: {e}")
@@ -269,28 +321,28 @@ async def test_llm_endpoint():
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc: HTTPException):
     """Custom HTTP exception handler"""
-    logger.warning(f"HTTP {exc.status_code}: {exc.detail}")
-    return JSONResponse(
+    logger.warning("HTTP %s: %s", exc.status_code, exc.detail)
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": True,
             "status_code": exc.status_code,
             "message": exc.detail,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S UTC")
+            "timestamp": _ts(int(time.time()))
         }
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc: Exception):
     """General exception handler"""
-    logger.error(f"Unhandled exception: {str(exc)}")
-    return JSONResponse(
+    logger.error("Unhandled exception: %s", exc)
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": True,
             "status_code": 500,
             "message": "Internal server error",
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S UTC")
+            "timestamp": _ts(int(time.time()))
         }
     )
 
@@ -1,31 +1,169 @@
-import sqlite3, contextlib, pathlib, time
+import sqlite3, contextlib, pathlib, time, queue, os, threading
 
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "data.db"
 
-def run_sql(sql: str, timeout_s: float = 3.0):
-    if ";" in sql.strip().rstrip(";"):
-        return {"columns": [], "rows": [], "elapsed_sec": 0.0, "error": "Multiple statements are not allowed."}
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+# Map the DB file into memory so hot pages are read without a pread() per page.
+# 1 GiB covers data.db with room to grow; SQLite clamps to its compile-time max.
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(1 << 30)))
 
-    start = time.time()
+# Per-connection settings only; the journal mode persists in the file and is
+# set once by prepare_db(), and synchronous is moot on a query_only connection
+_PRAGMAS = (
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    "PRAGMA query_only=1",
+)
+
+# Per-connection LRU of prepared statements keyed on SQL text, kept by the
+# sqlite3 module itself; cache hits re-run the same SQL and skip re-parsing.
+STATEMENT_CACHE_SIZE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+# Progress-handler callback interval, in SQLite VM instructions
+PROGRESS_STEPS = 10000
+
+# Per-thread query deadline (time.monotonic_ns()), read by the progress handler
+_deadline = threading.local()
+
+def _abort_if_past_deadline() -> int:
+    # Nonzero aborts the running statement with OperationalError("interrupted")
+    deadline = getattr(_deadline, "ns", None)
+    return 1 if deadline is not None and time.monotonic_ns() > deadline else 0
+
+# Idle connections, all opened against _pool_path. The pool is rebuilt when
+# DB_PATH is repointed (tests monkeypatch it to a scratch database).
+_POOL: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=POOL_SIZE)
+_pool_path = None
+
+def _is_uri(path) -> bool:
+    # "file:" URIs (e.g. the tests' shared in-memory databases) open as URIs
+    return isinstance(path, str) and path.startswith("file:")
+
+def _connect(path, timeout_s: float) -> sqlite3.Connection:
+    # Plain tuple rows: no per-row dict, and column names are sent once in "columns".
+    conn = sqlite3.connect(
+        path,
+        uri=_is_uri(path),
+        timeout=timeout_s,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    conn.set_progress_handler(_abort_if_past_deadline, PROGRESS_STEPS)
+    return conn
+
+def _drain_pool():
+    while True:
+        try:
+            _POOL.get_nowait().close()
+        except queue.Empty:
+            return
+
+def _get_conn(timeout_s: float) -> sqlite3.Connection:
+    global _pool_path
+    if _pool_path != DB_PATH:
+        _drain_pool()
+        _pool_path = DB_PATH
+    try:
+        return _POOL.get_nowait()
+    except queue.Empty:
+        return _connect(DB_PATH, timeout_s)
+
+def _put_conn(conn: sqlite3.Connection):
+    if _pool_path != DB_PATH:
+        conn.close()
+        return
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+def close_pool():
+    """Close all idle pooled connections."""
+    _drain_pool()
+
+def prepare_db():
+    """One-time tuning of DB_PATH at setup, on a writable connection the query pool never has.
+
+    WAL journal mode, so readers never block on, or are blocked by, writes;
+    then planner statistics: a full ANALYZE the first time, then only what
+    PRAGMA optimize judges stale. Opens read-write without create, so a
+    missing database raises instead of leaving an empty file behind.
+    """
+    target = DB_PATH if _is_uri(DB_PATH) else f"file:{DB_PATH}?mode=rw"
+    with contextlib.closing(sqlite3.connect(target, uri=True)) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+            conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+
+def ping(timeout_s: float = 1.0) -> bool:
+    """Liveness probe on a dedicated connection so health checks never hold a pool slot."""
+    # Read-only so probing a missing file never creates an empty one in its place
+    target = DB_PATH if _is_uri(DB_PATH) else f"file:{DB_PATH}?mode=ro"
+    try:
+        with contextlib.closing(sqlite3.connect(target, uri=True, timeout=timeout_s)) as conn:
+            conn.execute("SELECT 1").fetchone()
+        return True
+    except Exception:
+        return False
+
+def run_sql(sql: str, timeout_s: float = 3.0, columnar: bool = False):
+    """Execute one read-only statement.
+
+    Rows come back as tuples under "rows", or, with columnar=True, as one list
+    per column under "column_data" (plus "row_count") for DataFrame/NumPy consumers.
+    """
+    sql = sql.strip()
+    # SQLite's own tokenizer: ignores ';' inside string literals and comments.
+    # The probe ';' goes on its own line so a trailing "-- comment" can't swallow it.
+    if not sqlite3.complete_statement(sql if sql.endswith(";") else sql + "\n;"):
+        return {"columns": [], "rows": [], "elapsed_sec": 0.0, "error": "Incomplete SQL statement."}
+
+    start = time.monotonic_ns()
+
+    def elapsed():
+        return round((time.monotonic_ns() - start) / 1e9, 4)
+
+    try:
+        conn = _get_conn(timeout_s)
+    except Exception as e:
+        return {"columns": [], "rows": [], "elapsed_sec": elapsed(), "error": str(e)}
+    _deadline.ns = start + int(timeout_s * 1e9)
     try:
-        with contextlib.closing(sqlite3.connect(DB_PATH, timeout=timeout_s)) as conn:
-            conn.row_factory = sqlite3.Row
-            with contextlib.closing(conn.cursor()) as cur:
-                cur.execute(sql)
-                rows = cur.fetchall()
-                cols = [d[0] for d in cur.description] if cur.description else []
+        with contextlib.closing(conn.cursor()) as cur:
+            cur.execute(sql)
+            rows = cur.fetchall()
+            cols = [d[0] for d in cur.description] if cur.description else []
+    except (sqlite3.ProgrammingError, sqlite3.Warning) as e:
+        # execute() rejects a second statement before running anything
+        # (sqlite3.Warning before Python 3.11, ProgrammingError after)
+        if "one statement at a time" in str(e):
+            return {"columns": [], "rows": [], "elapsed_sec": elapsed(),
+                   "error": "Multiple statements are not allowed."}
+        return {"columns": [], "rows": [], "elapsed_sec": elapsed(), "error": str(e)}
     except sqlite3.OperationalError as e:
         # SQL syntax or operational errors
         error_msg = str(e)
+        if error_msg == "interrupted":
+            return {"columns": [], "rows": [], "elapsed_sec": elapsed(),
+                   "error": f"Query timed out after {timeout_s}s and was cancelled."}
         if "syntax error" in error_msg.lower():
-            return {"columns": [], "rows": [], "elapsed_sec": round(time.time() - start, 4), 
+            return {"columns": [], "rows": [], "elapsed_sec": elapsed(),
                    "error": f"SQL Syntax Error: {error_msg}. Please check the generated SQL."}
         else:
-            return {"columns": [], "rows": [], "elapsed_sec": round(time.time() - start, 4), 
+            return {"columns": [], "rows": [], "elapsed_sec": elapsed(),
                    "error": f"SQL Execution Error: {error_msg}"}
     except Exception as e:
-        return {"columns": [], "rows": [], "elapsed_sec": round(time.time() - start, 4), "error": str(e)}
+        return {"columns": [], "rows": [], "elapsed_sec": elapsed(), "error": str(e)}
+    finally:
+        _deadline.ns = None
+        _put_conn(conn)
 
-    elapsed = time.time() - start
-    data = [dict(r) for r in rows]
-    return {"columns": cols, "rows": data, "elapsed_sec": round(elapsed, 4)}
+    if columnar:
+        column_data = [list(c) for c in zip(*rows)] if rows else [[] for _ in cols]
+        return {"columns": cols, "column_data": column_data, "row_count": len(rows), "elapsed_sec": elapsed()}
+    return {"columns": cols, "rows": rows, "elapsed_sec": elapsed()}
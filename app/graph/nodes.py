@@ -1,22 +1,28 @@
 from dataclasses import dataclass
 from typing import Dict, Any, List
 
-@dataclass
+# One of each is built per request. Values that are never reassigned are frozen;
+# __slots__ is spelled out (dataclass(slots=True) needs 3.10) and only on classes
+# without field defaults, which a slot can't carry.
+@dataclass(frozen=True)
 class Intent:
+    __slots__ = ("raw", "parsed")
     raw: str
     parsed: Dict[str, Any]
 
+# generate_sql fills in sql on the plan it is handed
 @dataclass
 class Plan:
     steps: List[str]
     sql: str = ""
 
-@dataclass
+@dataclass(frozen=True)
 class GuardedSQL:
+    __slots__ = ("sql", "reason")
     sql: str
     reason: str
 
-@dataclass
+@dataclass(frozen=True)
 class ExecutionResult:
     columns: list
     rows: list
@@ -1,26 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import logging
+import os
+import re
 from .nodes import Intent, Plan, GuardedSQL, ExecutionResult
-from ..models.sql_agent import question_to_sql, get_schema_text
+from ..models import sql_agent
+from ..models.sql_agent import get_schema_text
 try:
     # Optional guided re-ask if initial SQL is irrelevant
     from ..models.sql_agent import question_to_sql_with_guidance as _guided_ask
 except Exception:
     _guided_ask = None
-from ..guards.sql_guard import enforce_read_only_and_limit
-from ..executors.sqlite_exec import run_sql
+from ..guards.sql_guard import enforce_read_only_and_limit, strip_llm_artifacts, warm_schema_cache
+from ..executors.sqlite_exec import run_sql, prepare_db
+from ..utils import audit
 from ..utils.audit import log_query
 from ..utils.logger import get_logger
 from ..utils import cache as cache_utils
-from ..models.sqlite_syntax_fixer import fix_sqlite_syntax
-from ..models.query_optimizer import analyze_query_performance, check_query_timeout_risk
+from ..utils import semantic_cache
+from ..utils.concurrency import LLM_SLOTS
+
+logger = get_logger("pipeline")
+
+# Background work that can overlap the LLM round-trip (which is I/O-bound)
+_PREFETCH = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+# The fixer/optimizer modules are only needed once a fresh plan reaches the
+# post-processing chain; load them on first use rather than at import.
+@lru_cache(maxsize=None)
+def _syntax_fixer():
+    from ..models.sqlite_syntax_fixer import fix_sqlite_syntax
+    return fix_sqlite_syntax
+
+@lru_cache(maxsize=None)
+def _query_optimizer():
+    from ..models import query_optimizer
+    return query_optimizer
+
+@lru_cache(maxsize=None)
+def _optimizer():
+    # Stateless; one instance is shared by all requests
+    return _query_optimizer().QueryOptimizer()
+
+# Generic "latest transactions" fallback the LLM emits when it doesn't understand the question
+_DEGENERATE_RE = re.compile(
+    r"^select t\.id,\s*t\.amount,\s*t\.type,\s*t\.transaction_date from transactions t "
+    r"order by t\.transaction_date desc limit 25$",
+    re.I,
+)
+# One scan each over the question and the SQL; every heuristic below is then
+# a set-membership test on the hits
+_QUESTION_KEYWORDS = re.compile(
+    r"\b(transactions?|transaction_date|weekends?|today|recent(?:ly)?|withdrawals?"
+    r"|never|per|each|latest|last|newest)\b",
+    re.I,
+)
+_SQL_FEATURES = re.compile(
+    r"(?P<uses_tx>\b(?:from|join)\s+transactions\b)"
+    r"|(?P<group_by>\bgroup\s+by\b)"
+    r"|(?P<order_by_tx_date>\border\s+by\s+transaction_date\b)"
+    r"|(?P<withdrawal>withdrawal)",
+    re.I,
+)
+_MENTIONS_TX = frozenset({
+    "transaction", "transactions", "transaction_date",
+    "weekend", "weekends", "today", "recent", "recently",
+})
+_MENTIONS_WITHDRAWAL = frozenset({"withdrawal", "withdrawals"})
+_MENTIONS_GROUPING = frozenset({"per", "each"})
+_RECENCY_WORDS = frozenset({"latest", "recent", "recently", "today", "weekend", "weekends", "last", "newest"})
+
+def _question_hits(question: str) -> set:
+    return {w.lower() for w in _QUESTION_KEYWORDS.findall(question)}
+
+def _sql_hits(sql: str) -> set:
+    return {m.lastgroup for m in _SQL_FEATURES.finditer(sql)}
+
+def _degenerate_guidance(sql: str) -> list:
+    """Steer away from the generic 'latest transactions' query."""
+    if not _DEGENERATE_RE.match(sql):
+        return []
+    return [
+        "Do NOT return the generic 'latest transactions' query.",
+        "Answer the user's question using only relevant tables and attributes.",
+        "Avoid using transactions unless explicitly requested by the question.",
+    ]
+
+def _relevance_guidance(sql_hits: set, q_hits: set) -> list:
+    """Question doesn't mention transactions but the SQL uses them."""
+    if "uses_tx" not in sql_hits or not q_hits.isdisjoint(_MENTIONS_TX):
+        return []
+    return [
+        "Do NOT use the transactions table unless explicitly asked.",
+        "Use customers (c) and accounts (a) tables to compute counts per customer attributes.",
+        "For 'accounts per gender', join customers c to accounts a on a.customer_id = c.id, then GROUP BY c.gender and COUNT(a.id).",
+        "Return a single SELECT with GROUP BY, and ORDER BY count descending when appropriate.",
+    ]
+
+def _consistency_guidance(sql_hits: set, q_hits: set) -> list:
+    """Intent consistency checks between the question and the SQL."""
+    guidance = []
+    mentions_withdrawal = not q_hits.isdisjoint(_MENTIONS_WITHDRAWAL)
+    # If question mentions withdrawal but SQL doesn't, enforce it
+    if mentions_withdrawal and "withdrawal" not in sql_hits:
+        guidance.append("When question references withdrawals, include a predicate or CASE using t.type = 'withdrawal'.")
+    # If question implies 'never had' withdrawals, suggest anti-join pattern
+    if mentions_withdrawal and "never" in q_hits:
+        guidance.append("Return accounts with zero withdrawals using LEFT JOIN transactions t ON a.id = t.account_id AND t.type = 'withdrawal' and filter WHERE t.id IS NULL, or use NOT EXISTS.")
+    # If question implies grouping (per/each) but SQL lacks GROUP BY
+    if not q_hits.isdisjoint(_MENTIONS_GROUPING) and "group_by" not in sql_hits:
+        guidance.append("Use GROUP BY on the attribute being summarized and appropriate aggregates like COUNT().")
+    # Avoid ordering by transaction_date unless explicitly requested
+    if "order_by_tx_date" in sql_hits and q_hits.isdisjoint(_RECENCY_WORDS):
+        guidance.append("Do NOT ORDER BY transaction_date unless the question asks for recency; prefer ORDER BY aggregate when relevant.")
+    return guidance
+
+# (DB path, mtime_ns) -> schema hash of the last schema text read
+_SCHEMA_MEMO = {"stamp": None, "hash": None}
+
+def _schema_key() -> str:
+    """Schema hash for cache keys; steady state is one os.stat instead of a schema dump."""
+    path = getattr(sql_agent, "DB_PATH", None)
+    try:
+        stamp = (str(path), os.stat(path).st_mtime_ns)
+    except (OSError, TypeError, ValueError):
+        # Not a plain file (e.g. a memory URI): nothing to key on, so re-read
+        stamp = None
+    if stamp is None or stamp != _SCHEMA_MEMO["stamp"]:
+        _SCHEMA_MEMO.update(stamp=stamp, hash=cache_utils.schema_hash(get_schema_text()))
+    return _SCHEMA_MEMO["hash"]
+
+def _invalidate_schema_key():
+    _SCHEMA_MEMO.update(stamp=None, hash=None)
 
 def initialize_pipeline():
     """Initialize the pipeline and clear any cached data from previous runs"""
-    print("🔄 Initializing pipeline...")
+    logger.debug("🔄 Initializing pipeline...")
+    _invalidate_schema_key()
     cache_utils.clear_cache()
-    print("✅ Pipeline initialized with fresh cache")
+    try:
+        prepare_db()
+    except Exception as e:
+        logger.warning("⚠️ Database tuning skipped: %s", e)
+    try:
+        audit.ensure_schema()
+    except Exception as e:
+        logger.warning("⚠️ Audit log setup failed: %s", e)
+    logger.debug("✅ Pipeline initialized with fresh cache")
+
+def warm_schema() -> str:
+    """Read the schema for the plan cache and the guard now, ahead of the first request; returns its cache key."""
+    warm_schema_cache()
+    return _schema_key()
 
 def clear_pipeline_cache():
     """Clear the pipeline cache manually"""
+    _invalidate_schema_key()
     cache_utils.clear_cache()
     return {"status": "success", "message": "Pipeline cache cleared"}
 
@@ -31,16 +166,31 @@ def plan_query(intent: Intent) -> Plan:
     return Plan(steps=["generate_sql", "guard", "execute", "postprocess"])
 
 def generate_sql(plan: Plan, question: str) -> Plan:
-    schema_txt = get_schema_text()
-    key = cache_utils.schema_hash(schema_txt)
-    try:
-        sql = cache_utils.cached_plan(key, question)
-    except Exception:
-        sql = question_to_sql(question)
+    key = _schema_key()
+    plan_k = cache_utils.plan_key(key, question)
+    # Same question, same schema: the final SQL from last time, no fixer/optimizer passes
+    done_sql = cache_utils.get_processed(plan_k)
+    if done_sql is not None:
+        plan.sql = done_sql
+        return plan
+    # A near-duplicate question already went through the full cleanup below
+    cached_sql = semantic_cache.lookup(key, question)
+    if cached_sql is not None:
+        plan.sql = cached_sql
+        return plan
+    # A miss returns fresh LLM output; an LLM failure propagates instead of being retried here
+    # A hit already went through the guidance pass (and any correction was put back)
+    sql = cache_utils.get(plan_k)
+    from_cache = sql is not None
+    if not from_cache:
+        # Reading the guard's schema is a connect + PRAGMA per table when the
+        # DB changed; do it while waiting on the LLM instead of after
+        _PREFETCH.submit(warm_schema_cache)
+        sql = cache_utils.cached_plan(key, question, key=plan_k)
     # Improved SQL cleaning logic
     if sql:
         # Remove common LLM artifacts
-        sql = sql.replace("SQLResult:", "").replace("```sql", "").replace("```", "").replace('"""', '').strip()
+        sql = strip_llm_artifacts(sql)
         
         # Handle multiple statements more carefully
         if ";" in sql:
@@ -50,7 +200,8 @@ def generate_sql(plan: Plan, question: str) -> Plan:
                 sql = statements[0]
         
         # Basic SQL validation
-        if not sql.lower().startswith("select"):
+        # Only the prefix needs case-folding, not the whole statement
+        if sql[:6].lower() != "select":
             raise ValueError("Generated SQL must start with SELECT")
         
         # Remove any trailing semicolons
@@ -60,103 +211,50 @@ def generate_sql(plan: Plan, question: str) -> Plan:
         if not sql:
             raise ValueError("Generated SQL is empty")
 
-        # Detect degenerate generic SQL patterns and trigger a guided re-ask
-        sql_lower_full = sql.lower().strip().rstrip(";")
-        degenerate_candidates = [
-            "select t.id, t.amount, t.type, t.transaction_date from transactions t order by t.transaction_date desc limit 25",
-        ]
-        if _guided_ask is not None and any(sql_lower_full == p for p in degenerate_candidates):
-            try:
-                anti_pattern_guidance = "\n".join([
-                    "Do NOT return the generic 'latest transactions' query.",
-                    "Answer the user's question using only relevant tables and attributes.",
-                    "Avoid using transactions unless explicitly requested by the question.",
-                ])
-                guided_sql0 = _guided_ask(question, anti_pattern_guidance)
-                if guided_sql0 and guided_sql0.strip().lower().startswith("select"):
-                    sql = guided_sql0.strip().rstrip(";")
-                    try:
-                        cache_utils.clear_cache()
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-
-        # Relevance guard: if question doesn't mention transactions but SQL uses transactions, try guided re-ask once
-        q_lower = question.lower()
-        uses_transactions = " from transactions" in sql.lower() or " join transactions" in sql.lower()
-        mentions_transactions = any(word in q_lower for word in ["transaction", "transactions", "transaction_date", "weekend", "today", "recent"])
-        if uses_transactions and not mentions_transactions and _guided_ask is not None:
-            try:
-                guidance_lines = [
-                    "Do NOT use the transactions table unless explicitly asked.",
-                    "Use customers (c) and accounts (a) tables to compute counts per customer attributes.",
-                    "For 'accounts per gender', join customers c to accounts a on a.customer_id = c.id, then GROUP BY c.gender and COUNT(a.id).",
-                    "Return a single SELECT with GROUP BY, and ORDER BY count descending when appropriate.",
-                ]
-                guided_sql = _guided_ask(question, "\n".join(guidance_lines))
-                if guided_sql and guided_sql.strip().lower().startswith("select"):
-                    sql = guided_sql.strip().rstrip(";")
-                    # Clear cache so subsequent calls don't return the previous irrelevant cached SQL
-                    try:
-                        cache_utils.clear_cache()
-                    except Exception:
-                        pass
-            except Exception:
-                # Ignore guided re-ask failure and keep original sql
-                pass
-
-        # Additional intent consistency checks and guided correction
-        if _guided_ask is not None:
-            sql_lower = sql.lower()
-            guidance = []
-            # If question mentions withdrawal but SQL doesn't, enforce it
-            if ("withdrawal" in q_lower) and ("withdrawal" not in sql_lower):
-                guidance.append("When question references withdrawals, include a predicate or CASE using t.type = 'withdrawal'.")
-            # If question implies 'never had' withdrawals, suggest anti-join pattern
-            if ("never" in q_lower and "withdrawal" in q_lower):
-                guidance.append("Return accounts with zero withdrawals using LEFT JOIN transactions t ON a.id = t.account_id AND t.type = 'withdrawal' and filter WHERE t.id IS NULL, or use NOT EXISTS.")
-            # If question implies grouping (per/each) but SQL lacks GROUP BY
-            if (" per " in q_lower or " for each" in q_lower or "each " in q_lower) and ("group by" not in sql_lower):
-                guidance.append("Use GROUP BY on the attribute being summarized and appropriate aggregates like COUNT().")
-            # Avoid ordering by transaction_date unless explicitly requested
-            if ("order by transaction_date" in sql_lower) and not any(w in q_lower for w in ["latest", "recent", "today", "weekend", "last", "newest"]):
-                guidance.append("Do NOT ORDER BY transaction_date unless the question asks for recency; prefer ORDER BY aggregate when relevant.")
-
+        # Collect guidance from every rule group and re-ask the LLM at most once
+        if _guided_ask is not None and not from_cache:
+            q_hits = _question_hits(question)
+            sql_hits = _sql_hits(sql)
+            guidance = (
+                _degenerate_guidance(sql)
+                + _relevance_guidance(sql_hits, q_hits)
+                + _consistency_guidance(sql_hits, q_hits)
+            )
             if guidance:
                 try:
-                    guided_sql2 = _guided_ask(question, "\n".join(guidance))
-                    if guided_sql2 and guided_sql2.strip().lower().startswith("select"):
-                        sql = guided_sql2.strip().rstrip(";")
-                        try:
-                            cache_utils.clear_cache()
-                        except Exception:
-                            pass
+                    with LLM_SLOTS:
+                        guided_sql = _guided_ask(question, "\n".join(guidance))
+                    guided_sql = guided_sql.strip() if guided_sql else ""
+                    if guided_sql[:6].lower() == "select":
+                        sql = guided_sql.rstrip(";")
+                        # Overwrite just this question's entry so the next ask hits the corrected SQL
+                        cache_utils.put(plan_k, sql)
                 except Exception:
+                    # Ignore guided re-ask failure and keep original sql
                     pass
     
     # Apply SQLite syntax fixes
     try:
-        logger = get_logger("pipeline")
-        fixed_sql, fixes_summary = fix_sqlite_syntax(sql)
+        fixed_sql, fixes_summary = _syntax_fixer()(sql)
         if fixed_sql != sql:
-            logger.info(f"🔧 Applied SQLite syntax fixes: {fixes_summary}")
+            logger.info("🔧 Applied SQLite syntax fixes: %s", fixes_summary)
             sql = fixed_sql
     except Exception as e:
-        logger.warning(f"⚠️ SQLite syntax fixer failed: {e}")
+        logger.warning("⚠️ SQLite syntax fixer failed: %s", e)
     
     # Analyze query performance and apply optimizations
     try:
         # Check for timeout risk
-        should_reject, reject_reason = check_query_timeout_risk(sql)
+        query_optimizer = _query_optimizer()
+        should_reject, reject_reason = query_optimizer.check_query_timeout_risk(sql)
         if should_reject:
-            logger.warning(f"⚠️ Query rejected due to timeout risk: {reject_reason}")
+            logger.warning("⚠️ Query rejected due to timeout risk: %s", reject_reason)
             raise ValueError(f"Query timeout risk: {reject_reason}")
         
         # Get performance analysis
-        analysis = analyze_query_performance(sql)
-        logger.info(f"📊 Query complexity: {analysis.complexity_score} ({analysis.risk_level} risk)")
-        logger.info(f"📈 Query metrics: {analysis.table_count} tables, {analysis.join_count} JOINs, {analysis.subquery_count} subqueries")
+        analysis = query_optimizer.analyze_query_performance(sql)
+        logger.info("📊 Query complexity: %s (%s risk)", analysis.complexity_score, analysis.risk_level)
+        logger.info("📈 Query metrics: %s tables, %s JOINs, %s subqueries", analysis.table_count, analysis.join_count, analysis.subquery_count)
         
         # Apply optimized SQL if available
         if analysis.optimized_sql and analysis.risk_level == 'high':
@@ -165,26 +263,29 @@ def generate_sql(plan: Plan, question: str) -> Plan:
         
         # Apply aggressive optimization for very complex queries
         try:
-            from ..models.query_optimizer import QueryOptimizer
-            optimizer = QueryOptimizer()
+            optimizer = _optimizer()
             if optimizer._is_very_complex_query(sql):
                 aggressive_sql = optimizer._apply_aggressive_optimization(sql)
                 if aggressive_sql != sql:
                     logger.info("⚡ Applied aggressive optimization for very complex query")
                     sql = aggressive_sql
         except Exception as e:
-            logger.warning(f"⚠️ Aggressive optimization failed: {e}")
+            logger.warning("⚠️ Aggressive optimization failed: %s", e)
         
         # Log recommendations for future improvements
         if analysis.recommendations:
-            logger.info(f"💡 Performance recommendations: {'; '.join(analysis.recommendations[:3])}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("💡 Performance recommendations: %s", "; ".join(analysis.recommendations[:3]))
             
     except ValueError:
         # Re-raise timeout errors
         raise
     except Exception as e:
-        logger.warning(f"⚠️ Query performance analysis failed: {e}")
+        logger.warning("⚠️ Query performance analysis failed: %s", e)
     
+    if sql:
+        cache_utils.store_processed(plan_k, sql)
+    semantic_cache.store(key, question, sql)
     plan.sql = sql
     return plan
 
@@ -195,24 +296,23 @@ def guard_sql(plan: Plan, role: str = "analyst") -> GuardedSQL:
     safe_sql, reason = enforce_read_only_and_limit(plan.sql, default_limit=200, role=role, table_mapping=table_map)
     return GuardedSQL(sql=safe_sql, reason=reason)
 
-def execute_sql(guarded: GuardedSQL):
-    return run_sql(guarded.sql)
+def execute_sql(guarded: GuardedSQL, columnar: bool = False):
+    return run_sql(guarded.sql, columnar=columnar)
 
 def postprocess(table: dict, role: str = "analyst"):
     return table
 
-def run_pipeline(question: str, role: str = "analyst", user: str = "anonymous"):
-    logger = get_logger("pipeline")
-    logger.info(f"🎯 Starting pipeline for user={user}, role={role}")
-    logger.info(f"📝 Question: {question}")
+def run_pipeline(question: str, role: str = "analyst", user: str = "anonymous", columnar: bool = False):
+    logger.info("🎯 Starting pipeline for user=%s, role=%s", user, role)
+    logger.info("📝 Question: %s", question)
     
     intent = parse_intent(question)
     plan = plan_query(intent)
     
     try:
-        logger.info(f"🤖 Generating SQL for question: '{question[:120]}'")
+        logger.info("🤖 Generating SQL for question: '%.120s'", question)
         plan = generate_sql(plan, question)
-        logger.info(f"✅ SQL generation completed: {len(plan.sql) if plan.sql else 0} chars")
+        logger.info("✅ SQL generation completed: %d chars", len(plan.sql) if plan.sql else 0)
     except ValueError as e:
         # SQL generation failed - return error table
         table = {
@@ -249,11 +349,11 @@ def run_pipeline(question: str, role: str = "analyst", user: str = "anonymous"):
     try:
         logger.info("🛡️ Guarding SQL and executing")
         guarded = guard_sql(plan, role=role)
-        logger.info(f"🔒 Guard result: {guarded.reason[:100] if guarded.reason else 'OK'}")
+        logger.info("🔒 Guard result: %.100s", guarded.reason or "OK")
         
         logger.info("⚡ Executing SQL query")
-        result = execute_sql(guarded)
-        logger.info(f"📊 Execution result: {len(result.get('rows', []))} rows, {result.get('elapsed_sec', 0):.3f}s")
+        result = execute_sql(guarded, columnar=columnar)
+        logger.info("📊 Execution result: %d rows, %.3fs", result.get('row_count', len(result.get('rows', []))), result.get('elapsed_sec', 0))
         
         table = postprocess(result, role=role)
     except ValueError as e:
@@ -1,50 +1,100 @@
+import os
 import re
-from typing import Tuple, Dict
-from sqlglot import parse
-from sqlglot.expressions import Select
-import sqlite3, pathlib
+from functools import lru_cache
+from typing import Tuple, Dict, Optional
+import sqlite3, pathlib, contextlib
 from ..utils.logger import get_logger
+try:
+    # Linear-time DFA matching on untrusted SQL; same compile/search API as re
+    import re2 as _scan_re
+except ImportError:
+    _scan_re = re
 
 logger = get_logger("sql_guard")
 
-FORBIDDEN = re.compile(r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|TRUNCATE|REPLACE|ATTACH|DETACH)\b", re.I)
+# Inline (?i): re2 takes no re.I flag argument
+FORBIDDEN = _scan_re.compile(r"(?i)\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|TRUNCATE|REPLACE|ATTACH|DETACH)\b")
+
+# LLM wrapper noise stripped from generated SQL, in one scan instead of four str.replace passes
+_ARTIFACTS = re.compile(r'SQLResult:|```sql|```|"""')
+
+def strip_llm_artifacts(sql: str) -> str:
+    return _ARTIFACTS.sub("", sql).strip()
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 DB_PATH = BASE / "data.db"
 
-def _get_schema_columns() -> Dict[str, set]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%';")
-    tables = [r[0] for r in cur.fetchall()]
-    schema = {}
-    for t in tables:
-        cur.execute(f"PRAGMA table_info({t})")
-        cols = {r[1] for r in cur.fetchall()}
-        schema[t] = cols
-    conn.close()
+# Schema as of the last DB_PATH mtime seen; the guard runs on every query,
+# so an os.stat replaces a connect + PRAGMA per table.
+_SCHEMA_CACHE = {"key": None, "schema": None, "qualifier": (None, {})}
+
+def _load_schema_columns() -> Dict[str, set]:
+    # Same "file:" URI handling as the executor, so both read the one database
+    uri = isinstance(DB_PATH, str) and DB_PATH.startswith("file:")
+    with contextlib.closing(sqlite3.connect(DB_PATH, uri=uri)) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%';")
+        tables = [r[0] for r in cur.fetchall()]
+        schema = {}
+        for t in tables:
+            cur.execute(f"PRAGMA table_info({t})")
+            schema[t] = {r[1] for r in cur.fetchall()}
     return schema
 
-def _qualify_unqualified_columns(sql: str, schema_cols: Dict[str, set]) -> str:
-    for col in set().union(*schema_cols.values()):
-        pattern = rf"(?<![\.\w]){re.escape(col)}(?![\.\w])"
-        owners = [t for t, cols in schema_cols.items() if col in cols]
-        if len(owners) == 1:
-            replacement = f"{owners[0]}.{col}"
-            sql = re.sub(pattern, replacement, sql)
-    return sql
+def _build_qualifier(schema_cols: Dict[str, set]):
+    """One alternation over every column owned by exactly one table, plus col -> "table.col"."""
+    owners: Dict[str, list] = {}
+    for t, cols in schema_cols.items():
+        for col in cols:
+            owners.setdefault(col, []).append(t)
+    mapping = {col: f"{ts[0]}.{col}" for col, ts in owners.items() if len(ts) == 1}
+    if not mapping:
+        return None, mapping
+    # Longest first so a column never loses to a shorter prefix alternative
+    alternation = "|".join(re.escape(c) for c in sorted(mapping, key=len, reverse=True))
+    return re.compile(rf"(?<![\.\w])({alternation})(?![\.\w])"), mapping
 
-def enforce_read_only_and_limit(sql: str, default_limit: int = 100, role: str = "analyst", table_mapping: Dict[str,str]=None) -> Tuple[str, str]:
-    s = sql.strip().rstrip(";")
-    s = s.replace("SQLResult:", "").replace("```sql", "").replace("```", "").replace('"""', '').strip()
+def _get_schema_columns() -> Dict[str, set]:
+    try:
+        key = (str(DB_PATH), os.stat(DB_PATH).st_mtime_ns)
+    except OSError:
+        # Not a plain file (e.g. a memory URI): nothing to key on, so re-read
+        key = None
+    if key is None or key != _SCHEMA_CACHE["key"]:
+        schema = _load_schema_columns()
+        _SCHEMA_CACHE.update(key=key, schema=schema, qualifier=_build_qualifier(schema))
+    return _SCHEMA_CACHE["schema"]
 
-    if FORBIDDEN.search(s):
-        raise ValueError("Blocked: non read-only SQL detected.")
+def warm_schema_cache():
+    """Load the schema (and its qualifier) ahead of the next guarded query."""
+    _get_schema_columns()
 
-    if table_mapping:
-        for orig, repl in table_mapping.items():
-            s = re.sub(rf"\b{orig}\b", repl, s, flags=re.IGNORECASE)
+def invalidate_schema_cache():
+    """Force the next guarded query to re-read the schema."""
+    _SCHEMA_CACHE.update(key=None, schema=None, qualifier=(None, {}))
+
+def _qualify_unqualified_columns(sql: str, schema_cols: Dict[str, set]) -> str:
+    if schema_cols is _SCHEMA_CACHE["schema"]:
+        pattern, mapping = _SCHEMA_CACHE["qualifier"]
+    else:
+        pattern, mapping = _build_qualifier(schema_cols)
+    if pattern is None:
+        return sql
+    return pattern.sub(lambda m: mapping[m.group(1)], sql)
+
+@lru_cache(maxsize=None)
+def _tokenizer():
+    """sqlglot is a heavy import; load it on the first guarded query, not at startup."""
+    from sqlglot import tokenize
+    from sqlglot.tokens import TokenType
+    return tokenize, TokenType
 
+@lru_cache(maxsize=2048)
+def _check_single_select(s: str) -> None:
+    """Raise ValueError unless s is one SELECT; verdicts depend only on the text, so
+    repeats of an accepted statement skip the parse (rejections aren't cached)."""
+    from sqlglot import parse
+    from sqlglot.expressions import Select
     try:
         exprs = parse(s, read="sqlite")
     except Exception as e:
@@ -58,19 +108,81 @@ def enforce_read_only_and_limit(sql: str, default_limit: int = 100, role: str =
     if not isinstance(expr, Select):
         raise ValueError("Only SELECT queries are allowed.")
 
+@lru_cache(maxsize=2048)
+def _top_level_limit(s: str) -> Tuple[bool, int, int, Optional[int]]:
+    """Where the outermost query's LIMIT row count sits in s, from tokens at paren depth 0.
+
+    Returns (found, start, end, n): the [start, end) span of the count expression
+    and its value when it is a plain integer literal (n is None for -1, ?, 10+0,
+    a subquery, ...). Without a top-level LIMIT, start == end is where one goes:
+    after the last token, so a trailing comment can't swallow it. A LIMIT inside
+    a subquery or CTE never counts as the outer cap.
+    """
+    tokenize, TokenType = _tokenizer()
+    tokens = tokenize(s, read="sqlite")
+    depth, limit_at = 0, None
+    for i, t in enumerate(tokens):
+        if t.token_type is TokenType.L_PAREN:
+            depth += 1
+        elif t.token_type is TokenType.R_PAREN:
+            depth -= 1
+        elif t.token_type is TokenType.LIMIT and depth == 0:
+            limit_at = i
+    if limit_at is None:
+        end = tokens[-1].end + 1 if tokens else len(s)
+        return False, end, end, None
+    # The count runs to OFFSET or the end; in "LIMIT offset, count" it follows the comma
+    expr, depth = [], 0
+    for t in tokens[limit_at + 1:]:
+        if depth == 0 and t.token_type is TokenType.OFFSET:
+            break
+        if depth == 0 and t.token_type is TokenType.COMMA:
+            expr = []
+            continue
+        if t.token_type is TokenType.L_PAREN:
+            depth += 1
+        elif t.token_type is TokenType.R_PAREN:
+            depth -= 1
+        expr.append(t)
+    if not expr:
+        end = tokens[limit_at].end + 1
+        return True, end, end, None
+    n = int(expr[0].text) if len(expr) == 1 and expr[0].token_type is TokenType.NUMBER and expr[0].text.isdigit() else None
+    return True, expr[0].start, expr[-1].end + 1, n
+
+@lru_cache(maxsize=64)
+def _mapping_patterns(items: Tuple[Tuple[str, str], ...]):
+    """Compiled word-boundary pattern per table rename, keyed on the mapping's items."""
+    return tuple((re.compile(rf"\b{orig}\b", re.IGNORECASE), repl) for orig, repl in items)
+
+def enforce_read_only_and_limit(sql: str, default_limit: int = 100, role: str = "analyst", table_mapping: Dict[str,str]=None) -> Tuple[str, str]:
+    s = sql.strip().rstrip(";")
+    s = strip_llm_artifacts(s)
+
+    if FORBIDDEN.search(s):
+        raise ValueError("Blocked: non read-only SQL detected.")
+
+    if table_mapping:
+        for pattern, repl in _mapping_patterns(tuple(table_mapping.items())):
+            s = pattern.sub(repl, s)
+
+    _check_single_select(s)
+
+    # Cap the outermost query before qualifying columns; the LIMIT lookup is keyed on this text
+    reason = "OK"
+    found, start, end, current_limit = _top_level_limit(s)
+    if not found:
+        if s[:6].lower() == "select":
+            s = f"{s[:start]} LIMIT {default_limit}{s[start:]}"
+            reason = f"LIMIT injected to cap result size at {default_limit}."
+    elif current_limit is None:
+        s = f"{s[:start]}{default_limit}{s[end:]}"
+        reason = f"LIMIT expression replaced with {default_limit} to cap result size."
+    elif current_limit > default_limit:
+        s = f"{s[:start]}{default_limit}{s[end:]}"
+        reason = f"LIMIT reduced from {current_limit} to {default_limit} to cap result size."
+
+    # The schema can change under us, so qualification stays per call
     schema_cols = _get_schema_columns()
     s = _qualify_unqualified_columns(s, schema_cols)
-
-    if s.lower().startswith("select") and " limit " not in s.lower():
-        s = f"{s} LIMIT {default_limit}"
-        return s, f"LIMIT injected to cap result size at {default_limit}."
-    
-    # Check if existing LIMIT exceeds the default limit
-    limit_match = re.search(r'LIMIT\s+(\d+)', s, re.IGNORECASE)
-    if limit_match:
-        current_limit = int(limit_match.group(1))
-        if current_limit > default_limit:
-            s = re.sub(r'LIMIT\s+\d+', f'LIMIT {default_limit}', s, flags=re.IGNORECASE)
-            return s, f"LIMIT reduced from {current_limit} to {default_limit} to cap result size."
-
-    return s, "OK"
+    return s, reason
@@ -1,13 +1,19 @@
 import streamlit as st
 import requests
 import pandas as pd
-import sqlite3, pathlib
+import numpy as np
+import sqlite3, pathlib, os
 
 st.set_page_config(page_title="Local NL → SQL (Offline)", layout="wide")
 st.title("🧠 Local NL → SQL (Offline)")
 
 API_URL = st.secrets.get("API_URL", "http://localhost:8000")
 
+@st.cache_resource
+def _http() -> requests.Session:
+    # One keep-alive session per server process instead of a new TCP connection per Ask
+    return requests.Session()
+
 user = st.text_input("User", value="test_user")
 role = st.selectbox("Role", options=["analyst", "viewer", "admin"], index=0)
 question = st.text_input("Ask a question", value="Top 5 branches by deposit amount")
@@ -15,7 +21,7 @@ question = st.text_input("Ask a question", value="Top 5 branches by deposit amou
 if st.button("Ask"):
     with st.spinner("Running pipeline..."):
         try:
-            r = requests.post(f"{API_URL}/ask", json={"question": question, "role": role, "user": user})
+            r = _http().post(f"{API_URL}/ask", json={"question": question, "role": role, "user": user, "columnar": True})
             if r.status_code == 200:
                 data = r.json()
 
@@ -68,9 +74,8 @@ if st.button("Ask"):
                         st.metric("⏱️ Query Time", f"{table['elapsed_sec']:.3f}s")
                     
                     # Row count
-                    rows = table.get("rows", [])
-                    if isinstance(rows, list):
-                        st.metric("📊 Results", len(rows))
+                    if "row_count" in table:
+                        st.metric("📊 Results", table["row_count"])
                 
                 # Show results
                 st.subheader("📊 Query Results")
@@ -97,24 +102,27 @@ if st.button("Ask"):
                             st.info("💡 **General Query Error**")
                             st.info("The query failed during execution. Check the error details above.")
                 else:
-                    rows = table.get("rows", [])
-                    if isinstance(rows, list) and rows:
-                        df = pd.DataFrame(rows)
+                    if table.get("row_count"):
+                        # Column-major payload: each column becomes one array, no per-row objects.
+                        # Keyed by position first so duplicate names from JOINs survive.
+                        df = pd.DataFrame(dict(enumerate(table.get("column_data", []))))
+                        df.columns = table.get("columns") or df.columns
                         st.dataframe(df, use_container_width=True)
                         
                         # Show summary statistics if numeric data
                         if len(df.columns) > 1 and df.iloc[:, 1].dtype in ['int64', 'float64']:
                             st.subheader("📈 Summary Statistics")
                             st.write(f"**Total Results:** {len(df)}")
-                            if len(df.columns) > 1:
-                                numeric_col = df.iloc[:, 1]
-                                if numeric_col.dtype in ['int64', 'float64']:
-                                    st.write(f"**Sum:** {numeric_col.sum():.2f}")
-                                    st.write(f"**Average:** {numeric_col.mean():.2f}")
-                                    st.write(f"**Min:** {numeric_col.min():.2f}")
-                                    st.write(f"**Max:** {numeric_col.max():.2f}")
-                    elif isinstance(rows, dict):
-                        st.json(rows)
+                            # Plain float64 array: NumPy's vectorized reductions, no
+                            # pandas null-mask/dtype dispatch per statistic
+                            values = df.iloc[:, 1].to_numpy(dtype=np.float64)
+                            values = values[~np.isnan(values)]  # NULLs, skipped like pandas does
+                            if values.size:
+                                total = values.sum()
+                                st.write(f"**Sum:** {total:.2f}")
+                                st.write(f"**Average:** {total / values.size:.2f}")
+                                st.write(f"**Min:** {values.min():.2f}")
+                                st.write(f"**Max:** {values.max():.2f}")
                     else:
                         st.info("ℹ️ No rows returned.")
                         
@@ -133,15 +141,19 @@ if st.button("Ask"):
             st.error(f"Failed to call API: {e}")
 
 # Sidebar with recent queries
+@st.cache_resource
+def _history_conn() -> sqlite3.Connection:
+    # One read-only connection shared across reruns instead of a connect per rerun
+    DB_PATH = pathlib.Path(os.getenv("AUDIT_DB_PATH", "app/audit.db")).resolve()
+    return sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+
 def get_history(limit=10):
-    DB_PATH = pathlib.Path("app/data.db")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            rows = conn.execute(
-                "SELECT user, role, question, safe_sql, ts FROM logs ORDER BY ts DESC LIMIT ?",
-                (limit,)
-            ).fetchall()
-        return rows
+        # Served newest-first by idx_logs_ts (created in audit.ensure_schema)
+        return _history_conn().execute(
+            "SELECT user, role, question, safe_sql, ts FROM logs ORDER BY ts DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
     except:
         return []
 
@@ -1,15 +1,127 @@
-import sqlite3, pathlib, datetime
+import sqlite3, pathlib, datetime, queue, threading, time, contextlib, os
 
-DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "data.db"
+# Kept out of data.db: anything in the queried database is visible to the
+# prompt's schema and to the guard's column qualifier
+DB_PATH = pathlib.Path(os.getenv("AUDIT_DB_PATH", pathlib.Path(__file__).resolve().parents[1] / "audit.db"))
 
-def log_query(user: str, role: str, question: str, raw_sql: str, safe_sql: str, status: str = "ok"):
-    ts = datetime.datetime.utcnow().isoformat()
+BATCH_SIZE = 100
+FLUSH_INTERVAL_S = 0.2
+
+# Records are queued by request threads and written in batches by one
+# background thread, so audit I/O never sits on the request path.
+_QUEUE: "queue.Queue[tuple]" = queue.Queue(maxsize=10000)
+_STOP = object()
+_writer = None
+_writer_lock = threading.Lock()
+dropped = 0
+
+def ensure_schema():
+    """Create the logs table if missing and index it for the newest-first history view.
+
+    Also puts the audit database in WAL mode (it persists in the file), so the
+    UI's history reader and the batch writer never block each other.
+    """
+    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS logs("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT, role TEXT, question TEXT, "
+            "raw_sql TEXT, safe_sql TEXT, status TEXT, ts TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs(ts DESC)")
+
+def _open(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    # Per connection; safe under WAL, and one fsync per checkpoint instead of per batch
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _write_batch(conn, batch) -> sqlite3.Connection:
+    """Insert batch in one transaction; returns the connection to keep using (None after an error)."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(
-                "INSERT INTO logs(user, role, question, raw_sql, safe_sql, status, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (user, role, question, raw_sql, safe_sql, status, ts),
-            )
-            conn.commit()
+        if conn is None:
+            conn = _open(DB_PATH)
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO logs(user, role, question, raw_sql, safe_sql, status, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        conn.execute("COMMIT")
+        return conn
     except Exception as e:
         print("Audit log error:", e)
+        if conn is not None:
+            conn.close()
+        return None
+
+def _drain():
+    # The writer thread owns one long-lived WAL connection instead of a
+    # connect + fsync per record; reopened if DB_PATH is repointed.
+    conn, conn_path = None, None
+    try:
+        while True:
+            item = _QUEUE.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + FLUSH_INTERVAL_S
+            while len(batch) < BATCH_SIZE:
+                try:
+                    item = _QUEUE.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            if conn is not None and conn_path != DB_PATH:
+                conn.close()
+                conn = None
+            conn_path = DB_PATH
+            conn = _write_batch(conn, batch)
+            if stop:
+                return
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_drain, name="audit-writer", daemon=True)
+            _writer.start()
+
+def log_query(user: str, role: str, question: str, raw_sql: str, safe_sql: str, status: str = "ok"):
+    global dropped
+    ts = datetime.datetime.utcnow().isoformat()
+    _ensure_writer()
+    try:
+        _QUEUE.put_nowait((user, role, question, raw_sql, safe_sql, status, ts))
+    except queue.Full:
+        dropped += 1
+
+def shutdown(timeout_s: float = 5.0) -> bool:
+    """Flush queued records and stop the writer thread, waiting at most timeout_s in total.
+
+    Returns False if the writer was still busy (e.g. a batch blocked on a locked
+    database) when time ran out; it is a daemon thread, so it never holds up exit.
+    """
+    global _writer
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return True
+    deadline = time.monotonic() + timeout_s
+    try:
+        # A full queue means the writer is stuck; don't wait on it indefinitely
+        _QUEUE.put(_STOP, timeout=timeout_s)
+    except queue.Full:
+        return False
+    writer.join(max(0.0, deadline - time.monotonic()))
+    if writer.is_alive():
+        return False
+    _writer = None
+    return True
@@ -1,15 +1,168 @@
-from functools import lru_cache
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Type
 import hashlib
+import os
+import re
+import threading
+import time
+import weakref
+from . import semantic_cache
+from .concurrency import LLM_SLOTS
+from .logger import get_logger
 
+logger = get_logger("cache")
+
+MAX_PLANS = 512
+# Seconds a failed generation is replayed to repeat callers instead of asking the LLM again
+NEGATIVE_TTL_S = float(os.getenv("PLAN_NEGATIVE_TTL_S", "5"))
+
+class _LRU:
+    """Bounded thread-safe mapping, least recently used evicted first."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: bytes, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: bytes):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# plan_key -> raw LLM SQL, and plan_key -> SQL after generate_sql's full
+# cleanup/fix/optimize chain (served as-is on a repeat question)
+_PLANS = _LRU(MAX_PLANS)
+_PROCESSED = _LRU(MAX_PLANS)
+# plan_key -> (expires_at, exception type, exception args) for recent LLM
+# failures, so an outage fails fast for NEGATIVE_TTL_S instead of every caller
+# waiting on a timeout. Values on _PLANS/_PROCESSED are SQL strings.
+_FAILURES = _LRU(MAX_PLANS)
+_Failure = Tuple[float, Type[BaseException], tuple]
+_flights_lock = threading.Lock()
+
+class _Flight:
+    """Per-key lock so concurrent misses for one question make a single LLM call."""
+    __slots__ = ("lock", "__weakref__")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+_flights: "weakref.WeakValueDictionary[bytes, _Flight]" = weakref.WeakValueDictionary()
+
+# blake2b: these are cache keys, not signatures, and it is ~2x faster than sha256
 def schema_hash(schema_text: str) -> str:
-    return hashlib.sha256(schema_text.encode('utf-8')).hexdigest()
+    return hashlib.blake2b(schema_text.encode('utf-8'), digest_size=16).hexdigest()
+
+_WS = re.compile(r"\s+")
+_QUOTED = re.compile(r"""('[^']*'|"[^"]*")""")
+
+def _normalize_question(question: str) -> str:
+    """Fold case and whitespace outside quotes; quoted literals like 'NYC' reach the SQL verbatim."""
+    parts = _QUOTED.split(question)
+    parts[::2] = [_WS.sub(" ", p).lower() for p in parts[::2]]
+    return "".join(parts).strip()
+
+def plan_key(schema_h: str, question: str) -> bytes:
+    """Fixed-size cache key, independent of question length."""
+    raw = f"{schema_h}\0{_normalize_question(question)}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def get(key: bytes) -> Optional[str]:
+    """Return the cached SQL for key, or None on a miss."""
+    return _PLANS.get(key)
+
+def _recent_failure(key: bytes) -> Optional[BaseException]:
+    """A fresh exception for a remembered failure, or None.
+
+    Each caller gets its own instance: re-raising one shared exception from
+    several threads would grow and overwrite its __traceback__.
+    """
+    entry: Optional[_Failure] = _FAILURES.get(key)
+    if entry is None:
+        return None
+    expires_at, exc_type, args = entry
+    if time.monotonic() >= expires_at:
+        _FAILURES.pop(key)
+        return None
+    try:
+        return exc_type(*args)
+    except Exception:
+        # Constructors that don't take their own args back
+        return RuntimeError(*args)
+
+def put(key: bytes, sql: str):
+    _PLANS.put(key, sql)
+    _FAILURES.pop(key)
+    # A new plan supersedes whatever was derived from the old one
+    _PROCESSED.pop(key)
+
+def invalidate(key: bytes):
+    _PLANS.pop(key)
+    _PROCESSED.pop(key)
+    _FAILURES.pop(key)
+
+def get_processed(key: bytes) -> Optional[str]:
+    """Final SQL previously produced for key by generate_sql, or None."""
+    return _PROCESSED.get(key)
+
+def store_processed(key: bytes, sql: str):
+    _PROCESSED.put(key, sql)
 
-@lru_cache(maxsize=512)
-def cached_plan(schema_h: str, question: str):
-    from ..models.sql_agent import question_to_sql
-    return question_to_sql(question)
+def cached_plan(schema_h: str, question: str, key: Optional[bytes] = None):
+    """Cached SQL for question; pass key when the caller already computed plan_key()."""
+    if key is None:
+        key = plan_key(schema_h, question)
+    sql = get(key)
+    if sql is not None:
+        return sql
+    exc = _recent_failure(key)
+    if exc is not None:
+        raise exc
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _flights[key] = _Flight()
+    with flight.lock:
+        # Another thread may have filled the entry while we waited
+        sql = get(key)
+        if sql is None:
+            # ...or failed just now, in which case it fails for us too
+            exc = _recent_failure(key)
+            if exc is not None:
+                raise exc
+            from ..models.sql_agent import question_to_sql
+            try:
+                with LLM_SLOTS:
+                    sql = question_to_sql(question)
+            except Exception as e:
+                if NEGATIVE_TTL_S > 0:
+                    _FAILURES.put(key, (time.monotonic() + NEGATIVE_TTL_S, type(e), e.args))
+                raise
+            if sql is not None:
+                put(key, sql)
+    return sql
 
 def clear_cache():
-    """Clear the LRU cache to force fresh SQL generation"""
-    cached_plan.cache_clear()
-    print("✅ Cache cleared!")
+    """Clear the plan cache (and the semantic tier) to force fresh SQL generation"""
+    _PLANS.clear()
+    _PROCESSED.clear()
+    _FAILURES.clear()
+    semantic_cache.clear()
+    logger.debug("✅ Cache cleared!")
@@ -0,0 +1,6 @@
+import os, threading
+
+# Local LLM inference is GPU-bound: more than a couple of concurrent generations
+# just thrash VRAM. Every question_to_sql / guided re-ask takes one slot.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))
+LLM_SLOTS = threading.BoundedSemaphore(LLM_CONCURRENCY)
@@ -1,14 +1,46 @@
-import logging, sys
+import logging, logging.handlers, sys, queue, atexit, threading
 from datetime import datetime
 
+# Request threads merge a record's %-args into its message (QueueHandler.prepare)
+# and enqueue it; one listener thread applies the full format and writes to
+# stdout, so stream I/O stays off the request path. The queue is bounded: if
+# the listener stalls, records are dropped and counted rather than piling up.
+_LOG_QUEUE: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=10000)
+_listener = None
+_listener_lock = threading.Lock()
+dropped = 0
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+def _stop_listener():
+    # A full queue at exit means the listener is stuck; don't block on it.
+    try:
+        _listener.stop()
+    except queue.Full:
+        pass
+
+def _start_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(name)s | %(message)s'))
+            _listener = logging.handlers.QueueListener(_LOG_QUEUE, handler)
+            _listener.start()
+            atexit.register(_stop_listener)
+
 def get_logger(name: str = "app"):
     logger = logging.getLogger(name)
     if not logger.handlers:
+        _start_listener()
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler(sys.stdout)
-        fmt = logging.Formatter('%(asctime)s | %(levelname)s | %(name)s | %(message)s')
-        handler.setFormatter(fmt)
-        logger.addHandler(handler)
+        logger.addHandler(_DroppingQueueHandler(_LOG_QUEUE))
     return logger
 
 def log_event(user, role, question, raw_sql, safe_sql, status="ok"):
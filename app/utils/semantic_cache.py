@@ -0,0 +1,118 @@
+"""Embedding-similarity cache in front of the exact-match plan cache.
+
+Paraphrased questions ("top 5 branches by deposit" vs "5 highest-deposit
+branches") miss the exact-match cache and pay a full LLM round-trip. This
+tier embeds each question with a sentence-transformers model and returns the
+final SQL of a previously answered question whose cosine similarity clears
+SEMANTIC_CACHE_THRESHOLD under the same schema hash.
+
+Opt-in via SEMANTIC_CACHE=1: a near match is not always an equivalent query,
+so entries only match when their numeric literals agree as well.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from .logger import get_logger
+
+logger = get_logger("semantic_cache")
+
+ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+MODEL_NAME = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+_lock = threading.Lock()
+# Held only while loading: a load takes seconds and hundreds of MB, so
+# concurrent first requests wait for one load instead of each starting theirs
+_model_lock = threading.Lock()
+_model = None
+_model_failed = False
+# question -> (schema_h, numeric literals, unit-norm embedding, sql), LRU ordered
+_entries: "OrderedDict[str, tuple]" = OrderedDict()
+# (schema_h, numeric literals) -> (questions, stacked embedding matrix), built on
+# first lookup after the group changes so a hit is one matrix-vector product
+_groups: dict = {}
+
+def _encode(question: str):
+    global _model
+    model = _model
+    if model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(MODEL_NAME)
+            model = _model
+    return model.encode(question, normalize_embeddings=True)
+
+@lru_cache(maxsize=256)
+def _embed(question: str):
+    # Memoized so a miss embeds once for both lookup() and store()
+    global _model_failed
+    if not ENABLED or _model_failed:
+        return None
+    try:
+        return _encode(question)
+    except Exception as e:
+        _model_failed = True
+        logger.warning("⚠️ Semantic cache disabled, embedding model unavailable: %s", e)
+        return None
+
+def _group_index(group):
+    index = _groups.get(group)
+    if index is None:
+        import numpy as np
+        questions = [q for q, entry in _entries.items() if entry[:2] == group]
+        if not questions:
+            return None
+        index = (questions, np.stack([_entries[q][2] for q in questions]))
+        _groups[group] = index
+    return index
+
+def lookup(schema_h: str, question: str) -> Optional[str]:
+    """Return cached SQL for a near-duplicate question, or None."""
+    if not _entries:
+        return None
+    emb = _embed(question)
+    if emb is None:
+        return None
+    group = (schema_h, tuple(_NUMBER_RE.findall(question)))
+    with _lock:
+        index = _group_index(group)
+        if index is None:
+            return None
+        questions, matrix = index
+        scores = matrix @ emb
+        best = int(scores.argmax())
+        if scores[best] < THRESHOLD:
+            return None
+        hit_q = questions[best]
+        _entries.move_to_end(hit_q)
+        return _entries[hit_q][3]
+
+def store(schema_h: str, question: str, sql: str):
+    if not sql:
+        return
+    emb = _embed(question)
+    if emb is None:
+        return
+    numbers = tuple(_NUMBER_RE.findall(question))
+    with _lock:
+        old = _entries.pop(question, None)
+        if old is not None:
+            _groups.pop(old[:2], None)
+        _entries[question] = (schema_h, numbers, emb, sql)
+        _groups.pop((schema_h, numbers), None)
+        while len(_entries) > MAX_ENTRIES:
+            _, evicted = _entries.popitem(last=False)
+            _groups.pop(evicted[:2], None)
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _groups.clear()
@@ -9,15 +9,44 @@ import subprocess
 import sys
 import os
 import argparse
+import json
+import socket
+import tempfile
+import time
+from importlib.util import find_spec
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import pytest
+
+_session = None
+
+# pytest-xdist workers for the pytest categories; --serial (or --coverage) turns it off
+PARALLEL = True
+COVERAGE = False
+# Run the comprehensive scripts side by side (--parallel-comprehensive); off by
+# default so they don't pile concurrent LLM requests onto the backend
+PARALLEL_COMPREHENSIVE = False
+
+def _http():
+    """Keep-alive session shared by the prerequisite probes (requests imported on first use)."""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        _session = requests.Session()
+        _session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.1)))
+    return _session
+
 def run_command(cmd, description):
-    """Run a command and return success status"""
+    """Run a command (an argument list, no shell) and return success status"""
     print(f"\n🧪 {description}")
     print("=" * 60)
     
     try:
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=False)
+        result = subprocess.run(cmd, check=True, capture_output=False)
         print(f"✅ {description} - PASSED")
         return True
     except subprocess.CalledProcessError as e:
@@ -27,16 +56,53 @@ def run_command(cmd, description):
         print(f"❌ {description} - ERROR: {e}")
         return False
 
+def run_pytest(args, description):
+    """Run pytest inside this interpreter and return success status"""
+    print(f"\n🧪 {description}")
+    print("=" * 60)
+    
+    rc = pytest.main(args)
+    if rc == 0:
+        print(f"✅ {description} - PASSED")
+        return True
+    print(f"❌ {description} - FAILED (exit code: {int(rc)})")
+    return False
+
+# The model list from /api/tags is reused across runner invocations for a minute
+TAGS_CACHE = Path(tempfile.gettempdir()) / "ollama_models.json"
+TAGS_TTL_S = 60
+OLLAMA_ADDR = ("localhost", 11434)
+
+def _ollama_models():
+    """Ollama's installed models, from TAGS_CACHE while fresh; None if the server answers non-200.
+
+    The cache only saves the /api/tags round-trip: a TCP connect runs every
+    time first, so a server that went down inside the TTL raises here.
+    """
+    socket.create_connection(OLLAMA_ADDR, timeout=0.5).close()
+    try:
+        if time.time() - TAGS_CACHE.stat().st_mtime < TAGS_TTL_S:
+            return json.loads(TAGS_CACHE.read_text())
+    except (OSError, ValueError):
+        pass
+    response = _http().get("http://%s:%d/api/tags" % OLLAMA_ADDR, timeout=3)
+    if response.status_code != 200:
+        return None
+    models = response.json().get("models", [])
+    try:
+        TAGS_CACHE.write_text(json.dumps(models))
+    except OSError:
+        pass
+    return models
+
 def check_prerequisites():
     """Check if required services are running"""
     print("🔍 Checking Prerequisites...")
     
     # Check if Ollama is running
     try:
-        import requests
-        response = requests.get("http://localhost:11434/api/tags", timeout=3)
-        if response.status_code == 200:
-            models = response.json().get("models", [])
+        models = _ollama_models()
+        if models is not None:
             print(f"✅ Ollama server running with {len(models)} models")
             
             # Check for required model
@@ -54,9 +120,11 @@ def check_prerequisites():
     
     # Check if backend is running (for integration tests)
     try:
-        response = requests.get("http://localhost:8000/health", timeout=3)
+        response = _http().get("http://localhost:8000/health", timeout=3)
         if response.status_code == 200:
             print("✅ Backend API is running")
+            # Inherited by the comprehensive scripts, which then skip their own probe
+            os.environ["APP_HEALTH_OK"] = "1"
         else:
             print("⚠️ Backend API not responding. Start with: uv run python run_app.py")
     except Exception:
@@ -64,48 +132,76 @@ def check_prerequisites():
     
     return True
 
+def _pytest_args(path, dist):
+    """pytest arguments for one category, spread over all cores unless PARALLEL is off."""
+    args = [path, "-v", "--tb=short", "-p", "no:cacheprovider"]
+    if PARALLEL:
+        if find_spec("xdist") is None:
+            print("ℹ️ pytest-xdist not installed; running serially")
+        else:
+            args += ["-n", "auto", f"--dist={dist}"]
+    if COVERAGE:
+        args += ["--cov=app", "--cov-report=html", "--cov-report=term"]
+    return args
+
 def run_unit_tests():
     """Run all unit tests"""
-    return run_command(
-        "uv run pytest tests/unit/ -v --tb=short",
+    return run_pytest(
+        _pytest_args("tests/unit/", "loadfile"),
         "Unit Tests"
     )
 
 def run_integration_tests():
     """Run integration tests"""
-    return run_command(
-        "uv run pytest tests/integration/ -v --tb=short",
+    # loadgroup keeps the xdist_group("llm") tests on one worker and spreads the rest
+    return run_pytest(
+        _pytest_args("tests/integration/", "loadgroup"),
         "Integration Tests"
     )
 
+COMPREHENSIVE = [
+    ("All Test Cases (35 questions)", ["uv", "run", "python", "tests/comprehensive/test_all_cases.py"]),
+    ("LLM Integration Test", ["uv", "run", "python", "tests/comprehensive/test_llm_integration.py"]),
+    ("Cache Integration Test", ["uv", "run", "python", "tests/comprehensive/test_cache_integration.py"]),
+]
+
+def _run_and_capture(description, cmd):
+    """Run a command with its output captured; returns (description, exit code, output)"""
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        return description, proc.returncode, proc.stdout + proc.stderr
+    except Exception as e:
+        return description, None, str(e)
+
 def run_comprehensive_tests():
     """Run comprehensive end-to-end tests"""
-    results = []
+    if not PARALLEL_COMPREHENSIVE:
+        return all([run_command(cmd, description) for description, cmd in COMPREHENSIVE])
     
-    # Test all cases
-    results.append(run_command(
-        "uv run python tests/comprehensive/test_all_cases.py",
-        "All Test Cases (35 questions)"
-    ))
-    
-    # LLM integration test
-    results.append(run_command(
-        "uv run python tests/comprehensive/test_llm_integration.py",
-        "LLM Integration Test"
-    ))
-    
-    # Cache integration test
-    results.append(run_command(
-        "uv run python tests/comprehensive/test_cache_integration.py",
-        "Cache Integration Test"
-    ))
+    # The scripts are independent and mostly wait on the backend, so they can
+    # overlap; output is captured per script and printed once each finishes
+    with ThreadPoolExecutor(max_workers=len(COMPREHENSIVE)) as executor:
+        futures = [executor.submit(_run_and_capture, description, cmd) for description, cmd in COMPREHENSIVE]
+        outcomes = [f.result() for f in futures]
     
+    results = []
+    for description, rc, output in outcomes:
+        print(f"\n🧪 {description}")
+        print("=" * 60)
+        print(output, end="")
+        if rc == 0:
+            print(f"✅ {description} - PASSED")
+        elif rc is None:
+            print(f"❌ {description} - ERROR: {output}")
+        else:
+            print(f"❌ {description} - FAILED (exit code: {rc})")
+        results.append(rc == 0)
     return all(results)
 
 def run_analysis_tools():
     """Run analysis tools"""
     return run_command(
-        "uv run python tests/analysis/analyze_testcases.py",
+        ["uv", "run", "python", "tests/analysis/analyze_testcases.py"],
         "Test Case Analysis"
     )
 
@@ -114,12 +210,12 @@ def run_manual_tests():
     results = []
     
     results.append(run_command(
-        "uv run python tests/manual/quick_cache_test.py",
-        "Quick Cache Test"
+        ["uv", "run", "python", "tests/manual/run_cache_tests.py"],
+        "Cache Test Runner"
     ))
     
     results.append(run_command(
-        "uv run python tests/manual/debug_imports.py",
+        ["uv", "run", "python", "tests/manual/debug_imports.py"],
         "Import Debug Test"
     ))
     
@@ -179,11 +275,27 @@ def main():
     parser.add_argument(
         "--coverage",
         action="store_true",
-        help="Run with coverage reporting"
+        help="Run with coverage reporting (implies --serial)"
+    )
+    parser.add_argument(
+        "--parallel-comprehensive",
+        action="store_true",
+        help="Run the comprehensive test scripts concurrently"
+    )
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="Run pytest categories in one process instead of with pytest-xdist"
     )
     
     args = parser.parse_args()
     
+    global PARALLEL, COVERAGE, PARALLEL_COMPREHENSIVE
+    # Per-worker coverage data would need a combine step; keep coverage runs serial
+    PARALLEL = not (args.serial or args.coverage)
+    COVERAGE = args.coverage
+    PARALLEL_COMPREHENSIVE = args.parallel_comprehensive
+    
     print("🧪 LOCAL SQL QUERY ORCHESTRATOR - TEST RUNNER")
     print(f"📅 Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"🎯 Running: {args.category} tests")
@@ -193,10 +305,6 @@ def main():
             print("\n⚠️ Prerequisites not met. Use --no-prereq-check to skip.")
             return False
     
-    # Add coverage flag if requested
-    if args.coverage and args.category in ["unit", "integration", "all"]:
-        os.environ["PYTEST_ADDOPTS"] = "--cov=app --cov-report=html --cov-report=term"
-    
     # Run selected test category
     if args.category == "analysis":
         success = run_analysis_tools()
@@ -12,11 +12,44 @@ Usage:
     uv run python tests/analysis/analyze_testcases.py
 """
 
+import re
+import numpy as np
 import pandas as pd
 import sys
 import os
 from pathlib import Path
 
+# Run as a script from tests/analysis; the shared workbook reader sits in tests/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from testcase_io import read_testcases
+
+# Category rules in priority order: a question gets the first one it matches
+CATEGORY_WORDS = (
+    ("Aggregation (COUNT, SUM, AVG)", ("count", "sum", "avg", "max", "min", "group by")),
+    ("JOINs", ("join", "inner", "left", "right", "outer")),
+    ("Date/Time Operations", ("date", "time", "yesterday", "last week", "month", "year")),
+    ("Subqueries", ("subquery", "exists", "in (select", "not in")),
+    ("Window Functions", ("window", "over", "partition", "rank", "row_number")),
+    ("Complex Conditions", ("where", "and", "or", "between", "like", "having")),
+    ("Simple SELECT", ("select", "show", "list", "get")),
+)
+
+# Complexity score factors: (weight, keywords)
+SCORE_WORDS = (
+    (2, ("join", "inner", "left", "right", "outer")),
+    (1, ("count", "sum", "avg", "max", "min")),
+    (2, ("group by", "having")),
+    (3, ("subquery", "exists", "in (select")),
+    (4, ("window", "over", "partition")),
+    (2, ("date", "time", "interval")),
+)
+
+# One regex scan per question finds every keyword it contains: the lookahead
+# makes matches overlap, so this equals `word in q` for each word
+_KEYWORD_SCAN = re.compile("(?=(" + "|".join(
+    map(re.escape, sorted({w for _, ws in CATEGORY_WORDS + SCORE_WORDS for w in ws}, key=len, reverse=True))
+) + "))")
+
 def analyze_testcases():
     """Analyze test cases and categorize them"""
     try:
@@ -32,7 +65,7 @@ def analyze_testcases():
             raise FileNotFoundError("TestCases (1).xlsx not found")
             
         print(f"📂 Reading test cases from: {excel_file}")
-        df = pd.read_excel(excel_file)
+        df = read_testcases(excel_file)
         
         print("📊 Test Cases Analysis")
         print("=" * 50)
@@ -60,7 +93,18 @@ def analyze_testcases():
             
             questions = df[question_col].dropna()
             
-            # Categorize questions
+            q = questions.astype(str).str.lower()
+            
+            hits = q.str.findall(_KEYWORD_SCAN).explode()
+            
+            def mentions(words):
+                return hits.isin(words).groupby(level=0, sort=False).any().to_numpy()
+            
+            # Categorize questions: first matching rule wins, as in an if/elif chain
+            rules = [(name, mentions(words)) for name, words in CATEGORY_WORDS]
+            rules[-1] = ("Simple SELECT", (q.str.split().str.len() <= 10).to_numpy() & rules[-1][1])
+            labels = np.select([mask for _, mask in rules], [name for name, _ in rules], default="Other Complex")
+            
             categories = {
                 "Simple SELECT": [],
                 "Aggregation (COUNT, SUM, AVG)": [],
@@ -71,26 +115,8 @@ def analyze_testcases():
                 "Window Functions": [],
                 "Other Complex": []
             }
-            
-            for idx, question in enumerate(questions):
-                q = str(question).lower()
-                
-                if any(word in q for word in ["count", "sum", "avg", "max", "min", "group by"]):
-                    categories["Aggregation (COUNT, SUM, AVG)"].append((idx+1, question))
-                elif any(word in q for word in ["join", "inner", "left", "right", "outer"]):
-                    categories["JOINs"].append((idx+1, question))
-                elif any(word in q for word in ["date", "time", "yesterday", "last week", "month", "year"]):
-                    categories["Date/Time Operations"].append((idx+1, question))
-                elif any(word in q for word in ["subquery", "exists", "in (select", "not in"]):
-                    categories["Subqueries"].append((idx+1, question))
-                elif any(word in q for word in ["window", "over", "partition", "rank", "row_number"]):
-                    categories["Window Functions"].append((idx+1, question))
-                elif any(word in q for word in ["where", "and", "or", "between", "like", "having"]):
-                    categories["Complex Conditions"].append((idx+1, question))
-                elif len(q.split()) <= 10 and any(word in q for word in ["select", "show", "list", "get"]):
-                    categories["Simple SELECT"].append((idx+1, question))
-                else:
-                    categories["Other Complex"].append((idx+1, question))
+            for idx, (label, question) in enumerate(zip(labels, questions)):
+                categories[label].append((idx+1, question))
             
             # Print categorized results
             for category, items in categories.items():
@@ -106,21 +132,10 @@ def analyze_testcases():
         print("🔧 Complexity Analysis:")
         print("=" * 50)
         
-        complexity_scores = {}
-        for idx, question in enumerate(questions):
-            q = str(question).lower()
-            score = 0
-            
-            # Scoring factors
-            if any(word in q for word in ["join", "inner", "left", "right", "outer"]): score += 2
-            if any(word in q for word in ["count", "sum", "avg", "max", "min"]): score += 1
-            if any(word in q for word in ["group by", "having"]): score += 2
-            if any(word in q for word in ["subquery", "exists", "in (select"]): score += 3
-            if any(word in q for word in ["window", "over", "partition"]): score += 4
-            if any(word in q for word in ["date", "time", "interval"]): score += 2
-            if q.count("and") + q.count("or") > 2: score += 1
-            
-            complexity_scores[idx+1] = score
+        # Scoring factors, summed as weighted masks over all questions
+        score = sum(weight * mentions(words) for weight, words in SCORE_WORDS)
+        score = score + ((q.str.count("and") + q.str.count("or")) > 2).to_numpy()
+        complexity_scores = {idx+1: int(v) for idx, v in enumerate(score)}
         
         # Categorize by complexity
         simple = [k for k, v in complexity_scores.items() if v <= 2]
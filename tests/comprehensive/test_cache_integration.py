@@ -4,13 +4,64 @@ Integration test to verify cache clearing functionality works properly.
 This script tests the actual cache behavior in the real application.
 """
 
-import time
+import asyncio
+import httpx
 import requests
-import sys
+from contextlib import nullcontext
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 import os
+import sys
+import time
+
+# One keep-alive pool for every probe in this module
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+API_URL = "http://localhost:8000"
+
+# The backend generates at most LLM_CONCURRENCY plans at once (app/utils/concurrency.py);
+# more requests than that in flight just queue there and run into the client timeout
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))
 
-# Add the app directory to the Python path
-sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+def _api_client(live_server):
+    """Client for the API tests: the app in-process by default, the running server with --live-server"""
+    if live_server:
+        return nullcontext(SESSION)
+    from fastapi.testclient import TestClient
+    from app.api.main import app
+    # Entering it runs the app lifespan; absolute API_URL paths are routed in-process
+    return TestClient(app)
+
+def _wait_ready(client, timeout=5):
+    """Poll /health until it answers 200, backing off from 5 ms up to 50 ms; False on timeout"""
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while True:
+        try:
+            if client.get(f"{API_URL}/health", timeout=1).status_code == 200:
+                return True
+        except Exception:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+@lru_cache(maxsize=None)
+def _backend_up(client):
+    """One readiness probe per client for the whole run; every API test shares its answer"""
+    # run_tests.py has already probed the live server when it sets this
+    if client is SESSION and os.environ.get("APP_HEALTH_OK") == "1":
+        return True
+    return _wait_ready(client)
+
+@lru_cache(maxsize=None)
+def _schema_key():
+    """Cache key of the app schema; the schema doesn't change during a run, so read it once"""
+    from app.utils.cache import schema_hash
+    from app.models.sql_agent import get_schema_text
+    return schema_hash(get_schema_text())
 
 def test_cache_clearing_manually():
     """Test cache clearing by directly calling the functions"""
@@ -18,16 +69,14 @@ def test_cache_clearing_manually():
     print("=" * 50)
     
     try:
-        from app.utils.cache import cached_plan, clear_cache, schema_hash
+        from app.utils.cache import cached_plan, clear_cache
         from app.graph.pipeline import initialize_pipeline, clear_pipeline_cache
-        from app.models.sql_agent import get_schema_text
         
         # Test 1: Basic cache functionality
         print("\n1️⃣ Testing basic cache functionality...")
         clear_cache()
         
-        schema = get_schema_text()
-        key = schema_hash(schema)
+        key = _schema_key()
         
         # Make the same call twice to test caching
         print("   Making first call...")
@@ -74,27 +123,22 @@ def test_cache_clearing_manually():
         print(f"\n❌ Manual cache test failed: {e}")
         return False
 
-def test_api_cache_clearing():
+def test_api_cache_clearing(client):
     """Test cache clearing via API endpoint"""
     print("\n🌐 Testing API Cache Clearing")
     print("=" * 30)
     
-    api_url = "http://localhost:8000"
+    api_url = API_URL
     
-    # Test if API is running
-    try:
-        response = requests.get(f"{api_url}/health", timeout=5)
-        if response.status_code != 200:
-            print("   ⚠️ API not running or not healthy")
-            return False
-    except requests.exceptions.RequestException:
-        print("   ⚠️ API not accessible at http://localhost:8000")
+    # Test if API is running (a freshly started server gets a few seconds to come up)
+    if not _backend_up(client):
+        print(f"   ⚠️ API not running or not healthy at {api_url}")
         return False
     
     # Test cache clearing endpoint
     try:
         print("   Calling /admin/clear-cache endpoint...")
-        response = requests.post(f"{api_url}/admin/clear-cache", timeout=10)
+        response = client.post(f"{api_url}/admin/clear-cache", timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -108,61 +152,65 @@ def test_api_cache_clearing():
         print(f"   ❌ API cache clear error: {e}")
         return False
 
-def test_end_to_end_cache_behavior():
+def test_end_to_end_cache_behavior(client):
     """Test end-to-end cache behavior with actual queries"""
     print("\n🔄 Testing End-to-End Cache Behavior")
     print("=" * 40)
     
-    api_url = "http://localhost:8000"
+    api_url = API_URL
     
-    try:
-        # Test if API is running
-        response = requests.get(f"{api_url}/health", timeout=5)
-        if response.status_code != 200:
-            print("   ⚠️ API not running - skipping E2E test")
-            return False
-    except:
-        print("   ⚠️ API not accessible - skipping E2E test")
+    # Test if API is running
+    if not _backend_up(client):
+        print("   ⚠️ API not running - skipping E2E test")
         return False
     
     # Clear cache first
     print("   Clearing cache via API...")
-    requests.post(f"{api_url}/admin/clear-cache")
+    client.post(f"{api_url}/admin/clear-cache")
     
     # Make the same query multiple times
     question = "Show me all branches"
-    results = []
+    answered = 0
+    distinct_sql = set()
     
     print(f"   Testing query: '{question}'")
     
-    for i in range(3):
-        print(f"   Making request {i+1}/3...")
-        try:
-            response = requests.post(f"{api_url}/ask", json={
-                "question": question,
-                "role": "analyst", 
-                "user": "test_user"
-            }, timeout=15)
-            
-            if response.status_code == 200:
-                data = response.json()
-                sql = data.get("sql", "")
-                results.append(sql)
-                print(f"   ✅ Request {i+1} SQL: {sql[:50]}...")
-            else:
-                print(f"   ❌ Request {i+1} failed: {response.status_code}")
-                results.append(None)
-                
-        except Exception as e:
-            print(f"   ❌ Request {i+1} error: {e}")
-            results.append(None)
+    async def _ask_concurrently(n):
+        # Identical requests in flight together (up to the backend's LLM slots):
+        # one generates, the rest share its plan.
+        # In-process runs hand the app straight to httpx instead of opening sockets
+        app = getattr(client, "app", None)
+        transport = httpx.ASGITransport(app=app) if app is not None else None
+        slots = asyncio.Semaphore(LLM_CONCURRENCY)
         
-        time.sleep(1)  # Brief pause between requests
+        async def _ask(ac):
+            async with slots:
+                return await ac.post("/ask", json={
+                    "question": question,
+                    "role": "analyst",
+                    "user": "test_user"
+                })
+        
+        async with httpx.AsyncClient(base_url=api_url, transport=transport, timeout=15) as ac:
+            return await asyncio.gather(*(_ask(ac) for _ in range(n)), return_exceptions=True)
+    
+    print("   Making 3 concurrent requests...")
+    for i, response in enumerate(asyncio.run(_ask_concurrently(3))):
+        if isinstance(response, Exception):
+            print(f"   ❌ Request {i+1} error: {response}")
+        elif response.status_code == 200:
+            # The generated SQL comes back in the "explanation" field
+            sql = response.json().get("explanation", "")
+            if sql:
+                answered += 1
+                distinct_sql.add(sql)
+            print(f"   ✅ Request {i+1} SQL: {sql[:50]}...")
+        else:
+            print(f"   ❌ Request {i+1} failed: {response.status_code}")
     
     # Analyze results
-    valid_results = [r for r in results if r is not None]
-    if len(valid_results) >= 2:
-        if all(r == valid_results[0] for r in valid_results):
+    if answered >= 2:
+        if len(distinct_sql) == 1:
             print("   ✅ Consistent results (cache working or LLM deterministic)")
         else:
             print("   ⚠️ Inconsistent results (might indicate cache issues)")
@@ -177,18 +225,20 @@ def main():
     print("=" * 60)
     
     results = []
+    live_server = "--live-server" in sys.argv[1:]
     
     # Test 1: Manual cache functions
     print("\n📋 Test 1: Manual Cache Functions")
     results.append(test_cache_clearing_manually())
     
-    # Test 2: API cache clearing
-    print("\n📋 Test 2: API Cache Clearing")
-    results.append(test_api_cache_clearing())
-    
-    # Test 3: End-to-end behavior
-    print("\n📋 Test 3: End-to-End Cache Behavior")
-    results.append(test_end_to_end_cache_behavior())
+    with _api_client(live_server) as client:
+        # Test 2: API cache clearing
+        print("\n📋 Test 2: API Cache Clearing")
+        results.append(test_api_cache_clearing(client))
+        
+        # Test 3: End-to-end behavior
+        print("\n📋 Test 3: End-to-End Cache Behavior")
+        results.append(test_end_to_end_cache_behavior(client))
     
     # Summary
     print("\n" + "=" * 60)
@@ -213,7 +263,7 @@ def main():
     print("\n💡 Tips:")
     print("- Make sure Ollama is running: ollama serve")
     print("- Make sure CodeLlama is loaded: ollama run codellama:13b")
-    print("- Start the API: uv run python run_app.py")
+    print("- Against a running API (uv run python run_app.py): add --live-server")
     
     return passed == total
 
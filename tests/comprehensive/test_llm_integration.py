@@ -4,22 +4,50 @@ Comprehensive LLM Integration Test
 Tests if Ollama and the LLM model are working properly with the backend.
 """
 
+import asyncio
+import json
+import httpx
+import pytest
 import requests
-import time
-import sys
+import socket
 import os
+from requests.adapters import HTTPAdapter
+import sys
+
+# One keep-alive pool for every probe in this module
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# The backend generates at most LLM_CONCURRENCY plans at once (app/utils/concurrency.py);
+# more requests than that in flight just queue there and run into the client timeout
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))
+
+def _port_open(port, host="localhost"):
+    """Cheap liveness probe: can a TCP connection be opened at all?"""
+    with socket.socket() as s:
+        s.settimeout(0.05)
+        return s.connect_ex((host, port)) == 0
+
+# Under pytest, skip the module at collection instead of timing out test by test
+pytestmark = [
+    pytest.mark.skipif(not _port_open(11434), reason="Ollama not running on localhost:11434"),
+    pytest.mark.skipif(not _port_open(8000), reason="Backend not running on localhost:8000"),
+]
 
-# Add app to path for imports
-sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+def _ollama_tags():
+    """Fetch /api/tags; returns (status, json)"""
+    response = SESSION.get("http://localhost:11434/api/tags", timeout=5)
+    if response.status_code != 200:
+        return response.status_code, None
+    return 200, response.json()
 
 def test_ollama_server():
     """Test if Ollama server is running"""
     print("🔍 Testing Ollama Server Connection...")
     
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
+        status, data = _ollama_tags()
+        if status == 200:
             models = data.get("models", [])
             print(f"   ✅ Ollama server is running")
             print(f"   📋 Available models: {len(models)}")
@@ -36,7 +64,7 @@ def test_ollama_server():
                 print(f"   📝 Available models: {model_names}")
                 return False, target_model
         else:
-            print(f"   ❌ Ollama server returned status {response.status_code}")
+            print(f"   ❌ Ollama server returned status {status}")
             return False, None
             
     except requests.exceptions.ConnectionError:
@@ -55,30 +83,32 @@ def test_ollama_model_direct(model_name):
         payload = {
             "model": model_name,
             "prompt": "Generate only this SQL: SELECT 1 as test",
-            "stream": False,
+            # The first streamed chunk is proof enough; don't wait for the whole generation
+            "stream": True,
             "options": {
-                "num_ctx": 1024,
+                "num_ctx": 256,  # tiny prompt, small KV cache
                 "temperature": 0
             }
         }
         
-        response = requests.post(
+        with SESSION.post(
             "http://localhost:11434/api/generate", 
             json=payload, 
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            response_text = data.get("response", "").strip()
-            print(f"   ✅ Model responded successfully")
-            print(f"   📝 Response: {response_text[:100]}...")
-            print(f"   ⏱️ Done: {data.get('done', False)}")
-            return True, response_text
-        else:
-            print(f"   ❌ Model request failed with status {response.status_code}")
-            print(f"   📄 Response: {response.text[:200]}...")
-            return False, None
+            timeout=30,
+            stream=True
+        ) as response:
+            if response.status_code == 200:
+                line = next((l for l in response.iter_lines() if l), b"{}")
+                data = json.loads(line)
+                response_text = data.get("response", "").strip()
+                print(f"   ✅ Model responded successfully")
+                print(f"   📝 First token(s): {response_text[:100]}...")
+                print(f"   ⏱️ Done: {data.get('done', False)}")
+                return True, response_text
+            else:
+                print(f"   ❌ Model request failed with status {response.status_code}")
+                print(f"   📄 Response: {response.text[:200]}...")
+                return False, None
             
     except Exception as e:
         print(f"   ❌ Error testing model: {e}")
@@ -89,7 +119,7 @@ def test_backend_health():
     print("\n🏥 Testing Backend Health...")
     
     try:
-        response = requests.get("http://localhost:8000/health", timeout=5)
+        response = SESSION.get("http://localhost:8000/health", timeout=5)
         if response.status_code == 200:
             data = response.json()
             print(f"   ✅ Backend is running")
@@ -123,23 +153,32 @@ def test_llm_via_backend():
         "Find the total number of accounts"
     ]
     
+    async def _ask_all():
+        # Questions overlap up to the backend's LLM slots, so each one's 30s timeout
+        # covers its own generation rather than time spent queued behind others.
+        # Plain HTTP/1.1 with keep-alive: the backend speaks no h2c
+        slots = asyncio.Semaphore(LLM_CONCURRENCY)
+        
+        async def _ask(client, question):
+            async with slots:
+                return await client.post("/ask", json={
+                    "question": question,
+                    "role": "analyst",
+                    "user": "llm_test_user"
+                })
+        
+        async with httpx.AsyncClient(base_url="http://localhost:8000", timeout=30) as client:
+            return await asyncio.gather(*(_ask(client, question) for question in test_questions),
+                                        return_exceptions=True)
+    
     results = []
     
-    for i, question in enumerate(test_questions, 1):
+    for i, (question, response) in enumerate(zip(test_questions, asyncio.run(_ask_all())), 1):
         print(f"   🧪 Test {i}: '{question}'")
         
         try:
-            payload = {
-                "question": question,
-                "role": "analyst",
-                "user": "llm_test_user"
-            }
-            
-            response = requests.post(
-                "http://localhost:8000/ask",
-                json=payload,
-                timeout=30
-            )
+            if isinstance(response, Exception):
+                raise response
             
             if response.status_code == 200:
                 data = response.json()
@@ -162,8 +201,6 @@ def test_llm_via_backend():
         except Exception as e:
             print(f"      ❌ Request error: {e}")
             results.append(False)
-        
-        time.sleep(1)  # Brief pause between requests
     
     success_rate = sum(results) / len(results) if results else 0
     print(f"\n   📊 Success rate: {len([r for r in results if r])}/{len(results)} ({success_rate:.1%})")
@@ -175,7 +212,7 @@ def test_cache_clearing():
     print("\n🗑️ Testing Cache Clearing...")
     
     try:
-        response = requests.post("http://localhost:8000/admin/clear-cache", timeout=10)
+        response = SESSION.post("http://localhost:8000/admin/clear-cache", timeout=10)
         if response.status_code == 200:
             data = response.json()
             print(f"   ✅ Cache cleared successfully")
@@ -1,131 +1,223 @@
+import hashlib
+import os
 import pytest
 import pathlib
 import sqlite3
+import tempfile
+import uuid
 from fastapi.testclient import TestClient
 from app.api.main import app
 
-@pytest.fixture
+# pytest-xdist worker id ("gw0", ...), or "main" when not running distributed
+WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+def pytest_configure(config):
+    # Registered here too so the marker is known when pytest-xdist isn't installed
+    config.addinivalue_line(
+        "markers", "xdist_group(name): keep these tests on one xdist worker (used for LLM-bound tests with --dist=loadgroup)"
+    )
+
+@pytest.fixture(scope="session")
 def client():
-    return TestClient(app)
+    # Entering the client runs the app lifespan (DB check, pipeline init) once per session
+    with TestClient(app) as c:
+        yield c
+
+@pytest.fixture(scope="session")
+def ollama_ready():
+    """Probe Ollama once per session: its /api/tags answer and one tiny generation."""
+    import requests
+    host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+    model = os.environ.get("OLLAMA_MODEL", "hf.co/defog/sqlcoder-7b-2:latest")
+    state = {"available": False, "model": model, "model_loaded": False,
+             "tags_status": None, "tags": None, "generate_status": None, "generate": None}
+    with requests.Session() as http:
+        try:
+            r = http.get(host + "/api/tags", timeout=5)
+        except requests.exceptions.ConnectionError:
+            return state
+        state.update(available=True, tags_status=r.status_code, tags=r.json() if r.ok else None)
+        try:
+            # Only the response shape is checked, so keep the context and output tiny
+            r = http.post(host + "/api/generate", json={
+                "model": model,
+                "prompt": "Return only: SELECT 1 as one",
+                "options": {"num_ctx": 128, "num_predict": 8},
+                "stream": False
+            }, timeout=30)
+        except requests.exceptions.ConnectionError:
+            return state
+        # 404: the server is up but the model isn't pulled
+        state.update(generate_status=r.status_code, model_loaded=r.status_code != 404,
+                     generate=r.json() if r.ok else None)
+    return state
 
 @pytest.fixture
-def test_db_path(tmp_path):
-    """Create a temporary test database"""
-    db_path = tmp_path / "test.db"
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    
-    # Create test schema
-    cur.executescript("""
-    PRAGMA foreign_keys = ON;
-    
-    CREATE TABLE branches (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        city TEXT NOT NULL,
-        state TEXT NOT NULL
-    );
-    
-    CREATE TABLE customers (
-        id TEXT PRIMARY KEY,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        branch_id TEXT,
-        FOREIGN KEY (branch_id) REFERENCES branches(id)
-    );
-    
-    CREATE TABLE employees (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        branch_id TEXT,
-        FOREIGN KEY (branch_id) REFERENCES branches(id)
-    );
-
-    CREATE TABLE accounts (
-        id TEXT PRIMARY KEY,
-        customer_id TEXT,
-        branch_id TEXT
-        type TEXT NOT NULL,
-        balance REAL NOT NULL,
-        FOREIGN KEY (customer_id) REFERENCES customers(id),
-        FOREIGN KEY (branch_id) REFERENCES branches(id)
-    );
-    
-    CREATE TABLE transactions (
-        id TEXT PRIMARY KEY,
-        account_id TEXT,
-        employee_id TEXT,
-        amount REAL NOT NULL,
-        type TEXT NOT NULL,
-        transaction_date TEXT, -- Added
-        description TEXT, -- Added
-        FOREIGN KEY (account_id) REFERENCES accounts(id),
-        FOREIGN KEY (employee_id) REFERENCES employees(id)
-    );
-
-    CREATE TABLE loans (
-        id TEXT PRIMARY KEY,
-        customer_id TEXT,
-        loan_amount REAL NOT NULL,
-        status TEXT NOT NULL,
-        FOREIGN KEY (customer_id) REFERENCES customers(id)
-    );
-    
-    -- Create view for viewer role (limited customer data)
-    CREATE VIEW viewer_customers AS
-    SELECT id, first_name, last_name, branch_id
-    FROM customers;
-    """)
-    
-    # Insert test data
-    cur.executemany("INSERT INTO branches VALUES (?, ?, ?, ?)", [
-        ("BR001", "Downtown", "New York", "NY"),
-        ("BR002", "Uptown", "Chicago", "IL"),
-        ("BR003", "Midtown", "New York", "NY")
-    ])
-    
-    cur.executemany("INSERT INTO customers VALUES (?, ?, ?, ?)", [
-        ("CUST001", "John", "Doe", "BR001"),
-        ("CUST002", "Jane", "Smith", "BR002"),
-        ("CUST003", "Peter", "Jones", "BR001"),
-        ("CUST004", "Mary", "Johnson", "BR003"),
-    ])
-
-    cur.executemany("INSERT INTO employees VALUES (?, ?, ?)", [
-        ("EMP001", "Alice", "BR001"),
-        ("EMP002", "Bob", "BR002"),
-        ("EMP003", "Charlie", "BR001"),
-    ])
-    
-    cur.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?, ?)", [
-        ("ACC001", "CUST001", "BR001", "savings", 1000.0),
-        ("ACC002", "CUST002", "BR002", "checking", 2500.0),
-        ("ACC003", "CUST003", "BR001", "savings", 5000.0),
-        ("ACC004", "CUST004", "BR003", "checking", 100.0)
-    ])
-    
-    cur.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)", [
-        ("TXN001", "ACC001", "EMP001", 500.0, "deposit", "2023-01-15T10:00:00Z", "Initial deposit"),
-        ("TXN002", "ACC002", "EMP002", 1000.0, "deposit", "2023-01-16T11:00:00Z", "Paycheck"),
-        ("TXN003", "ACC003", "EMP003", 2000.0, "deposit", "2023-01-18T13:00:00Z", "Transfer"),
-        ("TXN004", "ACC002", "EMP002", 1500.0, "deposit", "2023-01-19T14:00:00Z", "Paycheck"),
-        ("TXN005", "ACC004", "EMP003", 50.0, "deposit", "2023-01-20T15:00:00Z", "Cash deposit"),
-        ("TXN006", "ACC001", "EMP001", -200.0, "withdrawal", "2023-01-21T16:00:00Z", "Bill payment")
-    ])
-    
-    cur.executemany("INSERT INTO loans VALUES (?, ?, ?, ?)", [
-        ("LOAN001", "CUST001", 10000.0, "approved"),
-        ("LOAN002", "CUST003", 5000.0, "pending")
-    ])
-    
-    conn.commit()
+def clear_cache():
+    """Drop cached plans after the test so the next one generates fresh SQL"""
+    yield
+    from app.utils.cache import clear_cache as _clear
+    _clear()
+
+# Schema and rows of the test database as one SQL text, parsed in a single executescript
+SEED_SCRIPT = """
+PRAGMA foreign_keys = ON;
+-- Throwaway database: no journal writes, no syncs
+PRAGMA journal_mode = MEMORY;
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = MEMORY;
+
+BEGIN;
+
+CREATE TABLE branches (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT NOT NULL,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE customers (
+    id TEXT PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    branch_id TEXT,
+    FOREIGN KEY (branch_id) REFERENCES branches(id)
+);
+
+CREATE TABLE employees (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    branch_id TEXT,
+    FOREIGN KEY (branch_id) REFERENCES branches(id)
+);
+
+CREATE TABLE accounts (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    branch_id TEXT,
+    type TEXT NOT NULL,
+    balance REAL NOT NULL,
+    FOREIGN KEY (customer_id) REFERENCES customers(id),
+    FOREIGN KEY (branch_id) REFERENCES branches(id)
+);
+
+CREATE TABLE transactions (
+    id TEXT PRIMARY KEY,
+    account_id TEXT,
+    employee_id TEXT,
+    amount REAL NOT NULL,
+    type TEXT NOT NULL,
+    transaction_date TEXT, -- Added
+    description TEXT, -- Added
+    FOREIGN KEY (account_id) REFERENCES accounts(id),
+    FOREIGN KEY (employee_id) REFERENCES employees(id)
+);
+
+CREATE TABLE loans (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    loan_amount REAL NOT NULL,
+    status TEXT NOT NULL,
+    FOREIGN KEY (customer_id) REFERENCES customers(id)
+);
+
+-- Create view for viewer role (limited customer data)
+CREATE VIEW viewer_customers AS
+SELECT id, first_name, last_name, branch_id
+FROM customers;
+
+-- Seed rows
+INSERT INTO branches VALUES
+    ('BR001', 'Downtown', 'New York', 'NY'),
+    ('BR002', 'Uptown', 'Chicago', 'IL'),
+    ('BR003', 'Midtown', 'New York', 'NY');
+
+INSERT INTO customers VALUES
+    ('CUST001', 'John', 'Doe', 'BR001'),
+    ('CUST002', 'Jane', 'Smith', 'BR002'),
+    ('CUST003', 'Peter', 'Jones', 'BR001'),
+    ('CUST004', 'Mary', 'Johnson', 'BR003');
+
+INSERT INTO employees VALUES
+    ('EMP001', 'Alice', 'BR001'),
+    ('EMP002', 'Bob', 'BR002'),
+    ('EMP003', 'Charlie', 'BR001');
+
+INSERT INTO accounts VALUES
+    ('ACC001', 'CUST001', 'BR001', 'savings', 1000.0),
+    ('ACC002', 'CUST002', 'BR002', 'checking', 2500.0),
+    ('ACC003', 'CUST003', 'BR001', 'savings', 5000.0),
+    ('ACC004', 'CUST004', 'BR003', 'checking', 100.0);
+
+INSERT INTO transactions VALUES
+    ('TXN001', 'ACC001', 'EMP001', 500.0, 'deposit', '2023-01-15T10:00:00Z', 'Initial deposit'),
+    ('TXN002', 'ACC002', 'EMP002', 1000.0, 'deposit', '2023-01-16T11:00:00Z', 'Paycheck'),
+    ('TXN003', 'ACC003', 'EMP003', 2000.0, 'deposit', '2023-01-18T13:00:00Z', 'Transfer'),
+    ('TXN004', 'ACC002', 'EMP002', 1500.0, 'deposit', '2023-01-19T14:00:00Z', 'Paycheck'),
+    ('TXN005', 'ACC004', 'EMP003', 50.0, 'deposit', '2023-01-20T15:00:00Z', 'Cash deposit'),
+    ('TXN006', 'ACC001', 'EMP001', -200.0, 'withdrawal', '2023-01-21T16:00:00Z', 'Bill payment');
+
+INSERT INTO loans VALUES
+    ('LOAN001', 'CUST001', 10000.0, 'approved'),
+    ('LOAN002', 'CUST003', 5000.0, 'pending');
+
+COMMIT;
+"""
+
+# Built seed reused across pytest runs until SEED_SCRIPT changes
+SEED_CACHE = pathlib.Path(tempfile.gettempdir()) / f"t2s-seed-{hashlib.blake2b(SEED_SCRIPT.encode()).hexdigest()[:16]}.db"
+
+@pytest.fixture(scope="session")
+def _seed_conn():
+    """Build the test schema and seed rows once, in memory, for the whole session"""
+    # Autocommit mode: the script opens and commits the one transaction for the whole seed
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    if SEED_CACHE.exists():
+        cached = sqlite3.connect(SEED_CACHE)
+        cached.backup(conn)
+        cached.close()
+    else:
+        conn.executescript(SEED_SCRIPT)
+        # Write under a per-worker name and rename, so concurrent workers never see a partial file
+        tmp = SEED_CACHE.with_name(f"{SEED_CACHE.stem}-{WORKER}-{uuid.uuid4().hex}.db")
+        out = sqlite3.connect(tmp)
+        conn.backup(out)
+        out.close()
+        os.replace(tmp, SEED_CACHE)
+    yield conn
     conn.close()
-    
-    return db_path
 
-@pytest.fixture
-def test_db(test_db_path, monkeypatch):
+@pytest.fixture(scope="session")
+def test_db_path(_seed_conn):
+    """Create the in-memory test database (a page copy of the seed) once per session (per xdist worker)"""
+    db_uri = f"file:test_{WORKER}_{uuid.uuid4().hex}?mode=memory&cache=shared"
+    # A shared-cache memory DB lives only while a connection holds it open
+    keeper = sqlite3.connect(db_uri, uri=True)
+    _seed_conn.backup(keeper)
+    yield db_uri
+    keeper.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def _audit_db(tmp_path_factory):
+    """Audit records written during the run go to a scratch file, never app/audit.db"""
+    from app.utils import audit
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(audit, "DB_PATH", tmp_path_factory.mktemp("audit") / "audit.db")
+        yield
+        audit.shutdown()
+
+# Autouse: nothing in a test run reads, or creates, the real app/data.db
+@pytest.fixture(scope="session", autouse=True)
+def test_db(test_db_path):
     """Patch the application to use the test database"""
-    monkeypatch.setattr("app.models.sql_agent.DB_PATH", test_db_path)
-    monkeypatch.setattr("app.executors.sqlite_exec.DB_PATH", test_db_path)
-    return test_db_path
+    # Tests only read through the guarded executor, so one copy serves the whole session.
+    # Every reader of the data DB is repointed: the prompt's schema, the guard's column
+    # qualifier and the executor must all see the same tables.
+    from app.guards import sql_guard
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("app.models.sql_agent.DB_PATH", test_db_path)
+        mp.setattr("app.executors.sqlite_exec.DB_PATH", test_db_path)
+        mp.setattr(sql_guard, "DB_PATH", test_db_path)
+        sql_guard.invalidate_schema_cache()
+        yield test_db_path
+    sql_guard.invalidate_schema_cache()
@@ -1,10 +1,7 @@
 import pytest
-from fastapi.testclient import TestClient
-from app.api.main import app
 
-@pytest.fixture
-def client():
-    return TestClient(app)
+# Every /ask test starts from an empty plan cache; the client itself is session-wide
+pytestmark = pytest.mark.usefixtures("clear_cache")
 
 def test_health_check(client):
     """Test the health check endpoint"""
@@ -12,6 +9,17 @@ def test_health_check(client):
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
+def test_ask_rejects_unknown_role(client):
+    """Roles outside analyst/viewer/admin fail request validation instead of running"""
+    response = client.post("/ask", json={
+        "question": "Show all branches",
+        "role": "invalid_role",
+        "user": "test_user"
+    })
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "role"]
+
+@pytest.mark.xdist_group(name="llm")
 @pytest.mark.parametrize("question, role", [
     ("Show all branches", "analyst"),
     ("list all customers", "viewer"),
@@ -33,18 +41,7 @@ def test_ask_endpoint_basic_queries(client, test_db, question, role):
     assert "rows" in data["table"]
     assert len(data["table"]["rows"]) > 0
 
-def test_ask_endpoint_with_invalid_role(client, test_db):
-    """Test that a query with an invalid role defaults to a safe role and succeeds."""
-    response = client.post("/ask", json={
-        "question": "Show all branches",
-        "role": "invalid_role",
-        "user": "test_user"
-    })
-    assert response.status_code == 200
-    data = response.json()
-    assert "table" in data
-    assert "error" not in data["table"]
-
+@pytest.mark.xdist_group(name="llm")
 def test_ask_endpoint_with_complex_query(client, test_db):
     """Test a complex query that requires LLM processing."""
     
@@ -78,6 +75,7 @@ def test_ask_endpoint_with_complex_query(client, test_db):
                 if isinstance(row[1], (int, float)):
                     assert row[1] >= 0  # Amount should be non-negative
 
+@pytest.mark.xdist_group(name="llm")
 def test_ask_endpoint_with_blocked_query(client, test_db):
     """Test that a malicious query is blocked by the guard and returns an error."""
     response = client.post("/ask", json={
@@ -91,6 +89,7 @@ def test_ask_endpoint_with_blocked_query(client, test_db):
     assert "error" in data["table"]
     assert "Blocked: non read-only SQL detected" in data["table"]["error"]
 
+@pytest.mark.xdist_group(name="llm")
 def test_ask_endpoint_with_no_results_query(client, test_db):
     """Test a valid query that should return no results."""
     response = client.post("/ask", json={
@@ -104,3 +103,22 @@ def test_ask_endpoint_with_no_results_query(client, test_db):
     table = data["table"]
     assert "error" not in table
     assert len(table["rows"]) == 0
+
+def test_ask_after_initialize_pipeline(client, test_db):
+    """Startup setup (DB tuning, audit table) leaves the queried schema untouched"""
+    from unittest.mock import patch
+    from app.graph.pipeline import initialize_pipeline
+    initialize_pipeline()
+    # Unqualified `id` is shared by every data table; an audit table beside
+    # them would make the guard rewrite it to logs.id
+    with patch("app.models.sql_agent.question_to_sql", return_value="SELECT id, name FROM branches"), \
+            patch("app.graph.pipeline._guided_ask", None):
+        response = client.post("/ask", json={
+            "question": "Show all branches",
+            "role": "analyst",
+            "user": "test_user"
+        })
+    assert response.status_code == 200
+    table = response.json()["table"]
+    assert "error" not in table
+    assert len(table["rows"]) == 3
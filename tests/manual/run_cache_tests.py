@@ -4,27 +4,33 @@ Simple test runner for cache functionality.
 Runs both unit tests and integration tests.
 """
 
-import subprocess
+import argparse
+import runpy
 import sys
-import os
+from importlib.util import find_spec
 
-def run_unit_tests():
+import pytest
+
+# Resolved from the project root, which is where this runner is started from
+INTEGRATION_SCRIPT = "tests/comprehensive/test_cache_integration.py"
+
+def run_unit_tests(workers="auto"):
     """Run the unit tests for cache functionality"""
     print("🧪 Running Unit Tests for Cache...")
     print("=" * 40)
     
     try:
-        result = subprocess.run([
-            sys.executable, "-m", "pytest", 
-            "tests/unit/test_cache.py", 
-            "-v", "--tb=short"
-        ], capture_output=True, text=True, cwd=os.getcwd())
-        
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
+        # In-process: no second interpreter start-up or re-import of the app
+        args = ["tests/unit/test_cache.py", "-v", "--tb=short"]
+        if workers is not None:
+            if find_spec("xdist") is None:
+                print("ℹ️ pytest-xdist not installed; running serially")
+            else:
+                # loadgroup keeps xdist_group("llm") tests on one worker
+                args += ["-n", str(workers), "--dist=loadgroup"]
+        rc = pytest.main(args)
         
-        if result.returncode == 0:
+        if rc == 0:
             print("✅ Unit tests PASSED!")
             return True
         else:
@@ -41,11 +47,8 @@ def run_integration_tests():
     print("=" * 45)
     
     try:
-        result = subprocess.run([
-            sys.executable, "test_cache_integration.py"
-        ], cwd=os.getcwd())
-        
-        return result.returncode == 0
+        # Load the script's functions (its __main__ block doesn't run) and call main() here
+        return bool(runpy.run_path(INTEGRATION_SCRIPT)["main"]())
         
     except Exception as e:
         print(f"❌ Error running integration tests: {e}")
@@ -53,13 +56,27 @@ def run_integration_tests():
 
 def main():
     """Run all cache tests"""
+    parser = argparse.ArgumentParser(description="Cache test runner")
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="Run the unit tests in one process instead of with pytest-xdist"
+    )
+    parser.add_argument(
+        "-n",
+        dest="workers",
+        default="auto",
+        help="pytest-xdist worker count (default: auto)"
+    )
+    args = parser.parse_args()
+    
     print("🎯 COMPLETE CACHE TEST SUITE")
     print("=" * 50)
     
     results = []
     
     # Run unit tests
-    results.append(run_unit_tests())
+    results.append(run_unit_tests(None if args.serial else args.workers))
     
     # Run integration tests  
     results.append(run_integration_tests())
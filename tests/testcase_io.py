@@ -0,0 +1,37 @@
+"""Test-case workbook loading shared by tests/comprehensive and tests/analysis.
+
+pandas is imported inside the functions, so a script that aborts early (e.g.
+on a failed health probe) never pays for it.
+"""
+import hashlib
+import tempfile
+from pathlib import Path
+
+def _read_workbook(path):
+    """Parse the workbook, with the native calamine reader when installed."""
+    import pandas as pd
+    try:
+        return pd.read_excel(path, engine="calamine")
+    except ImportError:
+        # python-calamine missing; fall back to pandas' default (openpyxl)
+        return pd.read_excel(path)
+
+def read_testcases(path):
+    """Load the test-case workbook, from a feather copy in the temp dir while it is newer than the workbook."""
+    import pandas as pd
+    path = Path(path)
+    tag = hashlib.blake2b(str(path.resolve()).encode("utf-8"), digest_size=8).hexdigest()
+    cached = Path(tempfile.gettempdir()) / f"{path.stem.replace(' ', '_')}-{tag}.feather"
+    try:
+        if cached.stat().st_mtime >= path.stat().st_mtime:
+            return pd.read_feather(cached)
+    except Exception:
+        # No copy yet, pyarrow missing, or an unreadable copy: parse the workbook
+        pass
+    df = _read_workbook(path)
+    try:
+        df.to_feather(cached)
+    except Exception:
+        # The copy is only an accelerator (needs pyarrow and Arrow-typed columns)
+        pass
+    return df
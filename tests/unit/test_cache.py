@@ -24,6 +24,31 @@ def test_cache_basic_functionality():
         assert mock_sql.call_count == 1  # Still 1, proving cache was used
 
 
+def test_cache_key_ignores_case_and_whitespace():
+    """Questions differing only in case or spacing share one cached plan"""
+    clear_cache()
+    
+    with patch('app.models.sql_agent.question_to_sql') as mock_sql:
+        mock_sql.return_value = "SELECT * FROM branches"
+        
+        assert cached_plan("schema", "Show branches") == "SELECT * FROM branches"
+        assert cached_plan("schema", "  show   branches\t") == "SELECT * FROM branches"
+        assert mock_sql.call_count == 1
+
+
+def test_cache_key_keeps_quoted_literals():
+    """Case inside quotes is part of the filter, so it keeps plans apart"""
+    clear_cache()
+    
+    with patch('app.models.sql_agent.question_to_sql') as mock_sql:
+        mock_sql.side_effect = ["SQL1", "SQL2"]
+        
+        assert cached_plan("schema", "Branches in 'NYC'") == "SQL1"
+        assert cached_plan("schema", "branches  IN 'NYC'") == "SQL1"
+        assert cached_plan("schema", "Branches in 'nyc'") == "SQL2"
+        assert mock_sql.call_count == 2
+
+
 def test_cache_clearing():
     """Test that cache clearing forces fresh calls"""
     # Clear cache first
@@ -110,22 +135,194 @@ def test_schema_hash_consistency():
     
     assert hash1 == hash2  # Same schema should produce same hash
     assert hash1 != hash3  # Different schema should produce different hash
-    assert len(hash1) == 64  # SHA256 hash should be 64 characters
+    assert len(hash1) == 32  # 16-byte BLAKE2b digest as hex
 
 
-def test_cache_with_exceptions():
-    """Test cache behavior when underlying function raises exceptions"""
+def test_cache_with_exceptions(monkeypatch):
+    """Failures are replayed for a short TTL, then the LLM is asked again"""
+    import time
+    from app.utils import cache
+    monkeypatch.setattr(cache, "NEGATIVE_TTL_S", 0.05)
     clear_cache()
     
     with patch('app.models.sql_agent.question_to_sql') as mock_sql:
         mock_sql.side_effect = Exception("LLM not available")
         
-        # Exception should be raised and not cached
         with pytest.raises(Exception, match="LLM not available"):
             cached_plan("schema", "test question")
         
-        # Second call should also raise exception (not cached)
+        # Within the TTL the failure is served from the cache
         with pytest.raises(Exception, match="LLM not available"):
             cached_plan("schema", "test question")
+        assert mock_sql.call_count == 1
+        
+        # Each replay is a new exception of the same type, not one shared instance
+        errors = []
+        for _ in range(2):
+            with pytest.raises(Exception, match="LLM not available") as excinfo:
+                cached_plan("schema", "test question")
+            errors.append(excinfo.value)
+        assert errors[0] is not errors[1]
+        assert type(errors[0]) is Exception
+        assert mock_sql.call_count == 1
         
-        assert mock_sql.call_count == 2  # Function called twice, no caching of exceptions
+        # After it the underlying function is called again
+        time.sleep(0.1)
+        with pytest.raises(Exception, match="LLM not available"):
+            cached_plan("schema", "test question")
+        assert mock_sql.call_count == 2
+
+
+def test_failure_does_not_poison_cache(monkeypatch):
+    """Once the failure TTL lapses, a successful answer is cached as usual"""
+    import time
+    from app.utils import cache
+    monkeypatch.setattr(cache, "NEGATIVE_TTL_S", 0.05)
+    clear_cache()
+    
+    with patch('app.models.sql_agent.question_to_sql') as mock_sql:
+        mock_sql.side_effect = [Exception("LLM not available"), "SELECT 1"]
+        
+        with pytest.raises(Exception, match="LLM not available"):
+            cached_plan("schema", "test question")
+        time.sleep(0.1)
+        assert cached_plan("schema", "test question") == "SELECT 1"
+        assert cached_plan("schema", "test question") == "SELECT 1"
+        assert mock_sql.call_count == 2
+        
+        # clear_cache() drops remembered failures too
+        mock_sql.side_effect = Exception("LLM not available")
+        clear_cache()
+        with pytest.raises(Exception):
+            cached_plan("schema", "test question")
+        clear_cache()
+        with pytest.raises(Exception):
+            cached_plan("schema", "test question")
+        assert mock_sql.call_count == 4
+
+
+def test_concurrent_misses_share_one_llm_call():
+    """Identical questions arriving together on a cold cache make a single LLM call"""
+    import threading
+    clear_cache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_sql(question):
+        started.set()
+        release.wait(5)
+        return "SELECT * FROM branches"
+
+    with patch('app.models.sql_agent.question_to_sql', side_effect=slow_sql) as mock_sql:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cached_plan("schema", "show branches"))) for _ in range(4)]
+        threads[0].start()
+        # The first caller holds the flight; the rest queue behind it
+        assert started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert results == ["SELECT * FROM branches"] * 4
+        assert mock_sql.call_count == 1
+
+
+def test_plan_key_get_put_invalidate():
+    """Keys are fixed-size digests and misses return None instead of raising"""
+    from app.utils import cache
+    clear_cache()
+
+    question = "Show customers " * 200
+    key = cache.plan_key("schema", question)
+    assert len(key) == 16
+    assert key == cache.plan_key("schema", "  " + question.lower())
+    assert key != cache.plan_key("other_schema", question)
+
+    assert cache.get(key) is None
+    cache.put(key, "SELECT 1")
+    assert cache.get(key) == "SELECT 1"
+    cache.invalidate(key)
+    assert cache.get(key) is None
+
+    # Processed SQL is dropped when its raw plan is replaced or invalidated
+    cache.store_processed(key, "SELECT 1 LIMIT 200")
+    assert cache.get_processed(key) == "SELECT 1 LIMIT 200"
+    cache.put(key, "SELECT 2")
+    assert cache.get_processed(key) is None
+    cache.store_processed(key, "SELECT 2 LIMIT 200")
+    clear_cache()
+    assert cache.get_processed(key) is None
+
+
+_FIRST_WORDS = ["branches", "customers", "top"]
+
+
+def _fake_encode(question):
+    """Deterministic unit vectors: questions sharing a first word are 'similar'."""
+    import numpy as np
+    vec = np.zeros(len(_FIRST_WORDS))
+    vec[_FIRST_WORDS.index(question.split()[0].lower())] = 1.0
+    return vec
+
+
+def test_semantic_cache_hits_paraphrase(monkeypatch):
+    """Near-duplicate questions under the same schema reuse cached SQL"""
+    from app.utils import semantic_cache
+    monkeypatch.setattr(semantic_cache, "ENABLED", True)
+    monkeypatch.setattr(semantic_cache, "_encode", _fake_encode)
+    semantic_cache._embed.cache_clear()
+    clear_cache()
+
+    semantic_cache.store("schema", "branches by deposit", "SELECT 1")
+    assert semantic_cache.lookup("schema", "branches ranked by deposit") == "SELECT 1"
+    assert semantic_cache.lookup("other_schema", "branches ranked by deposit") is None
+    assert semantic_cache.lookup("schema", "customers by gender") is None
+
+    # clear_cache() empties both tiers
+    clear_cache()
+    assert semantic_cache.lookup("schema", "branches by deposit") is None
+    semantic_cache._embed.cache_clear()
+
+
+def test_semantic_cache_requires_matching_numbers(monkeypatch):
+    """'top 5' and 'top 10' must never share a cached plan"""
+    from app.utils import semantic_cache
+    monkeypatch.setattr(semantic_cache, "ENABLED", True)
+    monkeypatch.setattr(semantic_cache, "_encode", _fake_encode)
+    semantic_cache._embed.cache_clear()
+    clear_cache()
+
+    semantic_cache.store("schema", "top 5 branches", "SELECT ... LIMIT 5")
+    assert semantic_cache.lookup("schema", "top 5 branches please") == "SELECT ... LIMIT 5"
+    assert semantic_cache.lookup("schema", "top 10 branches") is None
+    clear_cache()
+    semantic_cache._embed.cache_clear()
+
+
+def test_semantic_model_loads_once_under_concurrency(monkeypatch):
+    """Concurrent first lookups share a single embedding-model load"""
+    import sys
+    import threading
+    import time
+    import types
+    from app.utils import semantic_cache
+    loads = []
+
+    class FakeModel:
+        def __init__(self, name):
+            loads.append(name)
+            time.sleep(0.05)
+
+        def encode(self, question, normalize_embeddings=True):
+            return _fake_encode(question)
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=FakeModel))
+    monkeypatch.setattr(semantic_cache, "_model", None)
+    threads = [threading.Thread(target=semantic_cache._encode, args=("branches by deposit",)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert loads == [semantic_cache.MODEL_NAME]
@@ -35,6 +35,23 @@ def test_limit_enforcement():
     assert "LIMIT 1000" in safe_sql_high_limit.upper()
     assert "LIMIT reduced" in reason
 
+@pytest.mark.parametrize("sql, expected, reason", [
+    ("SELECT * FROM branches LIMIT -1", "SELECT * FROM branches LIMIT 100", "LIMIT expression replaced"),
+    ("SELECT * FROM branches LIMIT ?", "SELECT * FROM branches LIMIT 100", "LIMIT expression replaced"),
+    ("SELECT * FROM branches LIMIT 10+0", "SELECT * FROM branches LIMIT 100", "LIMIT expression replaced"),
+    ("SELECT * FROM branches LIMIT (SELECT COUNT(*) FROM customers)", "SELECT * FROM branches LIMIT 100", "LIMIT expression replaced"),
+    ("SELECT * FROM branches LIMIT 5000 OFFSET 10", "SELECT * FROM branches LIMIT 100 OFFSET 10", "LIMIT reduced"),
+    ("SELECT * FROM branches LIMIT 10, 5000", "SELECT * FROM branches LIMIT 10, 100", "LIMIT reduced"),
+    ("SELECT * FROM branches WHERE name IN (SELECT name FROM employees LIMIT 5)",
+     "SELECT * FROM branches WHERE name IN (SELECT name FROM employees LIMIT 5) LIMIT 100", "LIMIT injected"),
+    ("SELECT * FROM branches -- every branch", "SELECT * FROM branches LIMIT 100 -- every branch", "LIMIT injected"),
+])
+def test_top_level_limit_only(sql, expected, reason):
+    """Only the outermost LIMIT counts, and any count that isn't a small literal is capped."""
+    safe_sql, why = enforce_read_only_and_limit(sql)
+    assert safe_sql == expected
+    assert why.startswith(reason)
+
 def test_block_potentially_malicious_queries():
     """Test that common SQL injection and malicious patterns are blocked."""
     
@@ -47,3 +64,69 @@ def test_block_potentially_malicious_queries():
     # used to exfiltrate database schema information.
     with pytest.raises(ValueError, match="Only SELECT queries are allowed"):
         enforce_read_only_and_limit("SELECT * FROM branches UNION SELECT * FROM sqlite_master")
+
+def test_schema_columns_cached_until_db_changes(tmp_path, monkeypatch):
+    """The guard re-reads the schema only when the database file changes."""
+    import os, sqlite3
+    from app.guards import sql_guard
+
+    db = tmp_path / "guard.db"
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE branches (id TEXT, name TEXT)")
+    monkeypatch.setattr(sql_guard, "DB_PATH", db)
+    sql_guard.invalidate_schema_cache()
+
+    first = sql_guard._get_schema_columns()
+    assert first == {"branches": {"id", "name"}}
+    assert sql_guard._get_schema_columns() is first
+
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE customers (id TEXT, gender TEXT)")
+    os.utime(db, ns=(0, db.stat().st_mtime_ns + 1))
+    assert "customers" in sql_guard._get_schema_columns()
+    sql_guard.invalidate_schema_cache()
+
+def test_qualify_unqualified_columns_single_pass():
+    """Only columns owned by exactly one table are qualified, in one scan."""
+    from app.guards.sql_guard import _qualify_unqualified_columns
+    schema = {"customers": {"id", "gender"}, "accounts": {"id", "balance"}}
+    sql = "SELECT id, gender, a.balance, balance FROM customers"
+    assert _qualify_unqualified_columns(sql, schema) == (
+        "SELECT id, customers.gender, a.balance, accounts.balance FROM customers"
+    )
+
+def test_single_select_accepted():
+    """One SELECT (or WITH ... SELECT) passes, ';' inside a literal included."""
+    from app.guards.sql_guard import _check_single_select
+    _check_single_select("SELECT name FROM branches WHERE name = 'a;b'")
+    _check_single_select("WITH b AS (SELECT * FROM branches) SELECT * FROM b")
+    with pytest.raises(ValueError, match="Only single SELECT"):
+        _check_single_select("SELECT * FROM branches; SELECT * FROM customers")
+    with pytest.raises(ValueError, match="Only SELECT"):
+        _check_single_select("SELECT id FROM branches UNION SELECT id FROM customers")
+
+def test_malformed_select_rejected_by_guard():
+    """Truncated, unbalanced or garbled SELECTs fail in the guard, not later inside sqlite."""
+    for sql in [
+        "SELECT name FROM branches WHERE id IN (SELECT branch_id FROM customers",
+        "SELECT name) FROM branches",
+        "SELECT name FROM branches WHERE name = 'Downtown",
+        "SELECT name FROM branches WHERE",
+        "SELECT * FROM branches ORDER BY",
+        "SELECT 1 +",
+        "SELECT a FROM b c d e",
+    ]:
+        with pytest.raises(ValueError, match="Failed to parse SQL"):
+            enforce_read_only_and_limit(sql)
+
+def test_select_verdict_cached_rejections_not():
+    """Accepted statements are parsed once; rejected ones raise on every call."""
+    from app.guards.sql_guard import _check_single_select
+    _check_single_select.cache_clear()
+    sql = "WITH b AS (SELECT * FROM branches) SELECT id FROM b"
+    _check_single_select(sql)
+    _check_single_select(sql)
+    assert _check_single_select.cache_info().hits == 1
+    for _ in range(2):
+        with pytest.raises(ValueError, match="Only SELECT"):
+            _check_single_select("PRAGMA table_info(branches)")
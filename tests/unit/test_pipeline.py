@@ -49,3 +49,34 @@ def test_postprocess():
     assert isinstance(processed, dict)
     assert "columns" in processed
     assert "rows" in processed
+
+def test_guidance_rules_combine():
+    """All applicable rule groups contribute to a single guided re-ask"""
+    from app.graph import pipeline
+    sql = "SELECT t.id, t.amount, t.type, t.transaction_date FROM transactions t ORDER BY t.transaction_date DESC LIMIT 25"
+    q_hits = pipeline._question_hits("Accounts per gender")
+    sql_hits = pipeline._sql_hits(sql)
+    assert q_hits == {"per"}
+    assert sql_hits == {"uses_tx"}
+    assert pipeline._degenerate_guidance(sql)
+    assert pipeline._relevance_guidance(sql_hits, q_hits)
+    assert pipeline._consistency_guidance(sql_hits, q_hits)
+    assert pipeline._relevance_guidance(sql_hits, pipeline._question_hits("Recent transactions")) == []
+
+def test_execute_sql_columnar(test_db):
+    """Columnar mode returns one list per column instead of row tuples"""
+    guarded = GuardedSQL(sql="SELECT id, name FROM branches", reason="ok")
+    rows = execute_sql(guarded)
+    cols = execute_sql(guarded, columnar=True)
+    assert "rows" not in cols
+    assert cols["columns"] == rows["columns"]
+    assert cols["row_count"] == len(rows["rows"])
+    assert [tuple(r) for r in zip(*cols["column_data"])] == list(rows["rows"])
+
+def test_execute_sql_trailing_line_comment(test_db):
+    """A trailing -- comment is still a complete statement; an open quote is not"""
+    result = execute_sql(GuardedSQL(sql="SELECT id FROM branches -- every branch", reason="ok"))
+    assert "error" not in result
+    assert len(result["rows"]) > 0
+    result = execute_sql(GuardedSQL(sql="SELECT 'unterminated FROM branches", reason="ok"))
+    assert result["error"] == "Incomplete SQL statement."
@@ -13,6 +13,7 @@ def test_get_schema_text(test_db):
     assert "loans" in schema # New table
     assert "transaction_date" in schema # New column
 
+@pytest.mark.xdist_group(name="llm")
 def test_generate_sql_pipeline_with_llm():
     """
     Test the SQL generation pipeline with LLM only.
@@ -34,6 +35,7 @@ def test_generate_sql_pipeline_with_llm():
         # If LLM is not available, skip the test
         pytest.skip(f"LLM not available: {str(e)}")
 
+@pytest.mark.xdist_group(name="llm")
 def test_generate_sql_with_complex_question(test_db):
     """Test SQL generation with a complex question."""
     question = "Show top 5 branches by deposit amount"